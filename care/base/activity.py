@@ -0,0 +1,52 @@
+import heapq
+import logging
+from itertools import islice
+
+from django.db import models
+from django.db.models import Value
+
+from care.base.pagination import prefetch_page
+from care.transaction.models import Transaction, TransactionReal, TransactionRecurring
+
+logger = logging.getLogger(__name__)
+
+
+def activity_sources(userprofile_id):
+    """ The history KeysetSources of a user profile, each annotated with its activity_type """
+    sources = []
+    for model, activity_type in ((Transaction, 'share'), (TransactionReal, 'real'), (TransactionRecurring, 'recurring')):
+        sources += [
+            source.annotate(activity_type=Value(activity_type, output_field=models.CharField()))
+            for source in model.get_history_sources(userprofile_id)
+        ]
+    return sources
+
+
+def _iter_newest_first(source, chunk_size):
+    """ Yields the objects of a KeysetSource newest first, fetching the next chunk only when it is reached """
+    cursor = None
+    while True:
+        chunk = list(source.walk(newer=False, cursor=cursor)[:chunk_size])
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            return
+        cursor = source.key(chunk[-1])
+
+
+def activity_feed(userprofile_id, chunk_size=10):
+    """ Generator over all shares, real and recurring transactions of a user profile, newest first.
+
+    The sources are merged lazily and each is read in chunks of chunk_size rows, so taking the
+    first n items costs a few LIMIT queries no matter how long the history is.
+    """
+    return heapq.merge(
+        *[_iter_newest_first(source, chunk_size) for source in activity_sources(userprofile_id)],
+        key=lambda obj: (obj.last_modified, obj.id),
+        reverse=True
+    )
+
+
+def get_latest_activity(userprofile_id, n):
+    activity = list(islice(activity_feed(userprofile_id, chunk_size=n), n))
+    return prefetch_page(activity, activity_sources(userprofile_id))
@@ -0,0 +1,29 @@
+from django.contrib import admin
+
+from care.base.models import NotificationRun, OutgoingEmail, ShardLock
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'email_to', 'status', 'attempts', 'created', 'sent', 'next_attempt')
+    list_filter = ['status']
+    search_fields = ['email_to', 'subject']
+    date_hierarchy = 'created'
+
+
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
+
+
+class ShardLockAdmin(admin.ModelAdmin):
+    list_display = ('job', 'shard', 'locked_until', 'completed_period', 'started', 'finished', 'duration')
+    list_filter = ['job']
+
+
+admin.site.register(ShardLock, ShardLockAdmin)
+
+
+class NotificationRunAdmin(admin.ModelAdmin):
+    list_display = ('job', 'shard', 'period', 'started', 'finished', 'processed', 'queued', 'duration', 'throughput')
+    list_filter = ['job']
+
+
+admin.site.register(NotificationRun, NotificationRunAdmin)
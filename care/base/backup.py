@@ -0,0 +1,172 @@
+import datetime
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = 'care-'
+BACKUP_SUFFIX = '.sqlite.gz'
+BACKUP_NAME_FORMAT = '%Y%m%d-%H%M%S'
+BACKUP_NAME_PATTERN = re.compile(re.escape(BACKUP_PREFIX) + r'(\d{8}-\d{6})' + re.escape(BACKUP_SUFFIX) + '$')
+
+PAGES_PER_STEP = 1024
+MAX_RESTARTS = 5
+MAX_ATTEMPTS = 4
+RETRY_DELAY = 1
+KEEP_DAILY = 7
+KEEP_WEEKLY = 5
+KEEP_MONTHLY = 12
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy_database_stepped(source, copy, pages_per_step):
+    """ Copies source to copy in steps of pages_per_step pages. A write to the source by another
+    connection restarts the copy, it gives up when it restarted MAX_RESTARTS times. """
+    restarts = 0
+    previous_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, previous_remaining
+        if previous_remaining is not None and remaining > previous_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        previous_remaining = remaining
+
+    source.backup(copy, pages=pages_per_step, progress=progress)
+
+
+def _copy_database(source, copy, pages_per_step, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+    """ Copies source to copy with _copy_database_stepped. When the writes keep restarting the copy it
+    waits and tries again, doubling the wait after every attempt, and raises a BackupError after
+    max_attempts attempts. It never copies in a single step, that would block the writers for the
+    whole copy. """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            _copy_database_stepped(source, copy, pages_per_step)
+            return
+        except _TooManyRestarts:
+            logger.warning(
+                'backup attempt ' + str(attempt) + ' of ' + str(max_attempts) + ' restarted more than '
+                + str(MAX_RESTARTS) + ' times because of writes'
+            )
+        if attempt < max_attempts:
+            time.sleep(retry_delay)
+            retry_delay *= 2
+    raise BackupError(
+        'the backup restarted too often because of writes to the database, gave up after '
+        + str(max_attempts) + ' attempts'
+    )
+
+
+def backup_database(database_path, directory, pages_per_step=PAGES_PER_STEP, now=None):
+    """ Copies the live SQLite database to a gzipped file in directory and returns its path and timings.
+
+    Uses the online backup API, which copies pages_per_step pages at a time and only holds the read
+    lock of the database during a step, so writers are not blocked for the whole copy and the copy is
+    never torn. Raises a BackupError when writes keep restarting the copy, see _copy_database. The copy
+    is checked with PRAGMA integrity_check before it is compressed. """
+    now = now or datetime.datetime.now()
+    if not os.path.exists(database_path):
+        raise BackupError('there is no database at ' + database_path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, BACKUP_PREFIX + now.strftime(BACKUP_NAME_FORMAT) + BACKUP_SUFFIX)
+    copy_path = path + '.copy'
+    start = time.time()
+    try:
+        source = sqlite3.connect(database_path)
+        copy = sqlite3.connect(copy_path)
+        try:
+            _copy_database(source, copy, pages_per_step)
+            result = copy.execute('PRAGMA integrity_check').fetchall()
+        finally:
+            copy.close()
+            source.close()
+        if result != [('ok',)]:
+            raise BackupError('integrity check of ' + copy_path + ' failed: ' + str(result[:10]))
+        copied = time.time()
+
+        # written next to the final name and renamed, a crash never leaves a truncated backup behind
+        with open(copy_path, 'rb') as copy_file, gzip.open(path + '.part', 'wb', compresslevel=6) as compressed_file:
+            shutil.copyfileobj(copy_file, compressed_file, 1024 * 1024)
+        os.rename(path + '.part', path)
+        size = os.path.getsize(copy_path)
+    finally:
+        for leftover in (copy_path, path + '.part'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    end = time.time()
+
+    stats = {
+        'path': path,
+        'size': size,
+        'compressed_size': os.path.getsize(path),
+        'copy_duration': copied - start,
+        'duration': end - start,
+        'throughput': size / max(end - start, 1e-6),
+    }
+    logger.info(
+        'backup ' + path + ': ' + '%.1f' % (size / 1e6) + ' MB, ' + '%.1f' % (stats['compressed_size'] / 1e6)
+        + ' MB compressed, ' + '%.2f' % stats['duration'] + 's (' + '%.2f' % stats['copy_duration'] + 's copying), '
+        + '%.1f' % (stats['throughput'] / 1e6) + ' MB/s'
+    )
+    return stats
+
+
+def _monday(day):
+    return day - datetime.timedelta(day.weekday())
+
+
+def backups_to_keep(backup_times, now, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, keep_monthly=KEEP_MONTHLY):
+    """ The backup times to keep: the newest backup of each of the last keep_daily days, keep_weekly weeks
+    and keep_monthly months. The newest backup is always kept. """
+    today = now.date()
+    buckets = (
+        (keep_daily, lambda day: (today - day).days),
+        (keep_weekly, lambda day: (_monday(today) - _monday(day)).days // 7),
+        (keep_monthly, lambda day: (today.year - day.year) * 12 + today.month - day.month),
+    )
+    keep = set()
+    newest_first = sorted(backup_times, reverse=True)
+    if newest_first:
+        keep.add(newest_first[0])
+    for n_buckets, bucket_of in buckets:
+        seen = set()
+        for backup_time in newest_first:
+            bucket = bucket_of(backup_time.date())
+            if bucket < n_buckets and bucket not in seen:
+                seen.add(bucket)
+                keep.add(backup_time)
+    return keep
+
+
+def rotate_backups(directory, now=None, **keep):
+    """ Removes the backups in directory that backups_to_keep does not keep, returns the removed paths.
+    Only files named like the backups of backup_database are considered. """
+    now = now or datetime.datetime.now()
+    backups = {}
+    for filename in os.listdir(directory):
+        match = BACKUP_NAME_PATTERN.match(filename)
+        if match:
+            backups[datetime.datetime.strptime(match.group(1), BACKUP_NAME_FORMAT)] = os.path.join(directory, filename)
+    kept = backups_to_keep(backups, now, **keep)
+    removed = []
+    for backup_time, path in sorted(backups.items()):
+        if backup_time not in kept:
+            os.remove(path)
+            removed.append(path)
+    logger.info('kept ' + str(len(kept)) + ' backups, removed ' + str(len(removed)))
+    return removed
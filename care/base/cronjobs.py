@@ -4,43 +4,79 @@ Created on Aug 25, 2014
 @author: Bart Romgens
 '''
 
-from care.settings import BASE_DIR
 from care.userprofile.models import UserProfile, NotificationInterval
-from care.groupaccount.models import GroupAccount, GroupSetting
 from care.transaction.models import Transaction, TransactionRecurring
 
-from care.base import emailserver
+from care.base import backup, emailserver
+from care.base.models import NotificationRecipient, NotificationRun, OutgoingEmail
+from care.base.shards import current_period, in_shard, run_sharded
 
+from django.conf import settings
 from django_cron import CronJobBase, Schedule
 
-import shutil
-import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def send_transaction_histories(inteval_name):
+def send_transaction_histories(inteval_name, shard=0, n_shards=1, period=None, job=None):
+    """ Sends the transaction histories of the users in the shard, sharded on user profile id.
+    Resumes the run of the period if it was interrupted, see NotificationRun. Returns the number of emails it queued. """
     interval = NotificationInterval.objects.get(name=inteval_name)
-    userprofiles = UserProfile.objects.all().filter(historyEmailInterval=interval)
-    for userprofile in userprofiles:
-        logger.info(userprofile.displayname)
-        userprofile.send_transaction_history()
-
-
-def send_low_balance_reminders(inteval_name):
+    if interval.days == 0:
+        return 0
+    if period is None:
+        period = current_period(timedelta(days=interval.days), datetime.now())
+    userprofiles = in_shard(UserProfile.objects.all().filter(historyEmailInterval=interval), 'id', shard, n_shards)
+
+    def prepare(batch):
+        mails = UserProfile.transaction_history_mails(
+            UserProfile.objects.filter(id__in=[userprofile.id for userprofile in batch]), interval.days
+        )
+        return [(NotificationRecipient(userprofile_id=userprofile.id), mails.get(userprofile.id)) for userprofile in batch]
+
+    logger.info('send transaction histories of the last ' + str(interval.days) + ' days')
+    run = NotificationRun.resume(job or 'care.transaction_histories.' + inteval_name.lower(), shard, period)
+    return run.process(userprofiles, prepare).queued
+
+
+def send_low_balance_reminders(inteval_name, shard=0, n_shards=1, period=None, job=None):
+    """ Sends the low balance reminders of the groups in the shard, sharded on group account id.
+    Resumes the run of the period if it was interrupted, see NotificationRun. Returns the number of emails it queued. """
     interval = NotificationInterval.objects.get(name=inteval_name)
-    settings = GroupSetting.objects.all().filter(notification_lower_limit_interval=interval)
-    groups = GroupAccount.objects.all().filter(settings=settings)
-    for group in groups:
-        userprofiles = UserProfile.objects.filter(group_accounts=group)
-        for userprofile in userprofiles:
-            balance = UserProfile.get_balance(group.id, userprofile.id)
-            if balance < group.settings.notification_lower_limit:
-                assert group in userprofile.group_accounts.all()
-                emailserver.send_low_balance_reminder(userprofile.user, group)
-                    
+    if period is None:
+        period = current_period(timedelta(days=interval.days), datetime.now())
+    memberships = in_shard(UserProfile.get_low_balance_memberships(interval), 'groupaccount_id', shard, n_shards)
+
+    def prepare(batch):
+        return [
+            (
+                NotificationRecipient(userprofile_id=membership.userprofile_id, group_account_id=membership.groupaccount_id),
+                emailserver.low_balance_reminder_mail(membership.userprofile, membership.groupaccount, membership.balance)
+            )
+            for membership in batch
+        ]
+
+    run = NotificationRun.resume(job or 'care.low_balance_reminders.' + inteval_name.lower(), shard, period)
+    return run.process(memberships, prepare).queued
+
+
+def send_emails(job, inteval_name, every):
+    """ Sends the histories and reminders of an interval, sharded, see care.base.shards """
+    histories_job = job + '.histories'
+    run_sharded(
+        histories_job,
+        lambda shard, n_shards, period: send_transaction_histories(inteval_name, shard, n_shards, period, histories_job),
+        every
+    )
+    reminders_job = job + '.reminders'
+    run_sharded(
+        reminders_job,
+        lambda shard, n_shards, period: send_low_balance_reminders(inteval_name, shard, n_shards, period, reminders_job),
+        every
+    )
+
 
 class DailyBackup(CronJobBase):
     RUN_EVERY_MINS = 1*24*60
@@ -50,12 +86,9 @@ class DailyBackup(CronJobBase):
 
     def do(self):
         logger.info('backup database')
-        now = datetime.now()
-        nowStr = now.strftime('%Y%m%d')
         directory = './backup/'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        shutil.copy(os.path.join(BASE_DIR, 'care.sqlite'), directory + nowStr + 'care.sqlite')
+        backup.backup_database(settings.DATABASES['default']['NAME'], directory)
+        backup.rotate_backups(directory)
 
 
 class DailyEmails(CronJobBase):
@@ -65,8 +98,7 @@ class DailyEmails(CronJobBase):
     code = 'care.daily_emails'    # a unique code
 
     def do(self):
-        send_transaction_histories("Daily")
-        send_low_balance_reminders("Daily")
+        send_emails(self.code, "Daily", timedelta(minutes=self.RUN_EVERY_MINS))
 
 
 class WeeklyEmails(CronJobBase):
@@ -76,8 +108,7 @@ class WeeklyEmails(CronJobBase):
     code = 'care.weekly_emails'    # a unique code                    
             
     def do(self):
-        send_transaction_histories("Weekly")
-        send_low_balance_reminders("Weekly")
+        send_emails(self.code, "Weekly", timedelta(minutes=self.RUN_EVERY_MINS))
 
 
 class MonthlyEmails(CronJobBase):
@@ -87,8 +118,7 @@ class MonthlyEmails(CronJobBase):
     code = 'care.monthly_emails'    # a unique code
 
     def do(self):
-        send_transaction_histories("Monthly")
-        send_low_balance_reminders("Monthly")
+        send_emails(self.code, "Monthly", timedelta(minutes=self.RUN_EVERY_MINS))
 
 
 class TestEmails(CronJobBase):
@@ -103,6 +133,22 @@ class TestEmails(CronJobBase):
         send_transaction_histories("Monthly")
 
 
+class SendOutgoingEmails(CronJobBase):
+    RUN_EVERY_MINS = 5
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'care.send_outgoing_emails'
+
+    def do(self):
+        tried = 0
+        while True:
+            n_emails = OutgoingEmail.send_batch()
+            if n_emails == 0:
+                break
+            tried += n_emails
+        logger.info('tried to send ' + str(tried) + ' emails')
+
+
 class CreateRecurrentShareOccurrence(CronJobBase):
     RUN_EVERY_MINS = 2 * 60  # 2 hours
 
@@ -110,9 +156,13 @@ class CreateRecurrentShareOccurrence(CronJobBase):
     code = 'care.create_recurrent_share_occurrence'
 
     def do(self):
-        allRecurringShares = TransactionRecurring.objects.filter(
-            date__lte=datetime.now(),
-            last_occurrence__lt=datetime.now())
-        for rShare in allRecurringShares:
-            if rShare.next_due <= datetime.now():
-                rShare.create_occurrence()
+        now = datetime.now()
+        timings = run_sharded(
+            self.code,
+            lambda shard, n_shards, period: TransactionRecurring.create_due_occurrences(now, shard, n_shards),
+            timedelta(minutes=self.RUN_EVERY_MINS),
+            # creating occurrences is nearly all writes, and SQLite has a single writer
+            max_workers=1
+        )
+        created = sum(result for duration, result in timings.values())
+        logger.info('created ' + str(created) + ' recurring share occurrences')
@@ -1,38 +1,50 @@
 import os
-import threading
 import logging
 
-from django.core.mail import send_mail
-
-from care import settings
+from django.template import Context, Engine
+from django.utils.safestring import mark_safe
 
 module_dir = os.path.dirname(__file__)  # get current directory
 logger = logging.getLogger(__name__)
 
+# the email templates are read and compiled once per process by the cached loader
+template_engine = Engine(
+    dirs=[module_dir],
+    loaders=[('django.template.loaders.cached.Loader', ['django.template.loaders.filesystem.Loader'])],
+)
+
+
+def render_email(template_name, context):
+    return template_engine.get_template(template_name).render(Context(context))
+
+
+def html_mail(email_to, email_from, subject, message):
+    """ The email as an unsaved outbox row, for callers that queue many emails at once """
+    from care.base.models import OutgoingEmail
+    return OutgoingEmail(email_to=email_to, email_from=email_from, subject=subject, message=message)
+
 
 def send_html_mail(email_to, email_from, subject, message):
-    send_mail(subject, message, email_from, [email_to])
+    """ Queues the email in the outbox, it is sent by the SendOutgoingEmails cron job """
+    from care.base.models import OutgoingEmail
+    OutgoingEmail.queue(email_to, email_from, subject, message)
 
 
-def send_transaction_history(username, emailaddress, transactionTable, transactionRealTable, startDate, endDate):
+def transaction_history_mail(username, emailaddress, transactionTable, transactionRealTable, startDate, endDate):
     email_from = 'Care <info@computerautomatedremoteexchange.com>'
     email_to = emailaddress
     subject = 'Care transaction history'
-    logging.info('send_transaction_history from: ' + str(email_from) + ' to: ' + str(email_to))
-
-    message = ''
-    with open( os.path.join(module_dir, 'transactionhistorymail.html'), 'r' ) as filein:
-        data = filein.readlines()
-        for row in data:
-            message += row
+    logging.info('transaction_history_mail from: ' + str(email_from) + ' to: ' + str(email_to))
 
-    message = message.replace('{% transactionTable %}', transactionTable)
-    message = message.replace('{% transactionRealTable %}', transactionRealTable)
-    message = message.replace('{% username %}', username)
-    message = message.replace('{% startDate %}', startDate.strftime('%d %B %Y') )
-    message = message.replace('{% endDate %}', endDate.strftime('%d %B %Y') )
+    message = render_email('transactionhistorymail.html', {
+        'transactionTable': mark_safe(transactionTable),
+        'transactionRealTable': mark_safe(transactionRealTable),
+        'username': username,
+        'startDate': startDate.strftime('%d %B %Y'),
+        'endDate': endDate.strftime('%d %B %Y'),
+    })
 
-    send_html_mail(email_to, email_from, subject, message)
+    return html_mail(email_to, email_from, subject, message)
 
 
 def send_welcome_email(username, emailaddress):
@@ -41,15 +53,10 @@ def send_welcome_email(username, emailaddress):
     subject = 'Welcome to Care!'
     logging.debug('send_welcome_email from: ' + str(email_from) + ' to: ' + str(email_to))
 
-    message = ''
-
-    with open( os.path.join(module_dir, 'welcomemail.html'), 'r' ) as filein:
-        data = filein.readlines()
-        for row in data:
-            message += row
-
-    message = message.replace('{% username %}', username)
-    message = message.replace('{% email %}', emailaddress)
+    message = render_email('welcomemail.html', {
+        'username': username,
+        'email': emailaddress,
+    })
 
     send_html_mail(email_to, email_from, subject, message)
 
@@ -61,38 +68,27 @@ def send_invite_email(username_from, username_to, group_name, emailaddress):
 
     logging.debug('send_invite_email from: ' + str(email_from) + ' to: ' + str(email_to))
 
-    message = ''
-    with open( os.path.join(module_dir, 'invitemail.html'), 'r' ) as filein:
-        data = filein.readlines()
-        for row in data:
-            message += row
-
-    message = message.replace('{% usernameTo %}', username_to)
-    message = message.replace('{% usernameFrom %}', username_from)
-    message = message.replace('{% groupName %}', group_name)
+    message = render_email('invitemail.html', {
+        'usernameTo': username_to,
+        'usernameFrom': username_from,
+        'groupName': group_name,
+    })
 
     send_html_mail(email_to, email_from, subject, message)
 
 
-def send_low_balance_reminder(user, group):
+def low_balance_reminder_mail(userprofile, group, balance):
     email_from = 'Care <info@computerautomatedremoteexchange.com>'
-    email_to = user.email
+    email_to = userprofile.user.email
     subject = 'Low balance in ' + group.name + ''
 
-    logging.debug('send_low_balance_reminder from: ' + str(email_from) + ' to: ' + str(email_to))
+    logging.debug('low_balance_reminder_mail from: ' + str(email_from) + ' to: ' + str(email_to))
 
-    message = ''
-    with open( os.path.join(module_dir, 'balancereminder.html'), 'r' ) as filein:
-        data = filein.readlines()
-        for row in data:
-            message += row
+    message = render_email('balancereminder.html', {
+        'username': userprofile.displayname,
+        'group_name': group.name,
+        'group_user_balance': str('%.2f' % balance),
+        'lower_limit': str(group.settings.notification_lower_limit),
+    })
 
-    from care.userprofile.models import UserProfile
-    userprofile = UserProfile.objects.get(user=user)
-
-    message = message.replace('{% username %}', userprofile.displayname)
-    message = message.replace('{% group_name %}', group.name)
-    message = message.replace('{% group_user_balance %}', str('%.2f' % UserProfile.get_balance(group.id, userprofile.id)))
-    message = message.replace('{% lower_limit %}', str(group.settings.notification_lower_limit))
-
-    send_html_mail(email_to, email_from, subject, message)
+    return html_mail(email_to, email_from, subject, message)
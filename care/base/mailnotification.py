@@ -1,18 +1,70 @@
-from datetime import timedelta
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
 
 from care.transaction.models import Transaction
+from care.transaction.models import TransactionConsumer
 from care.transaction.models import TransactionReal
 
 
-def create_transaction_history_table_html(userprofile, date_start, date_end):
-    transactions_all = Transaction.get_transactions_sorted_by_last_modified(userprofile.id)
+def _modified_in_range(date_start, date_end, prefix=''):
+    """ Modified after the day date_start, up to and including the day date_end """
+    return Q(**{
+        prefix + 'last_modified__gte': datetime.combine(date_start + timedelta(1), time(0)),
+        prefix + 'last_modified__lt': datetime.combine(date_end + timedelta(1), time(0)),
+    })
+
+
+def create_transaction_history_tables(userprofiles, date_start, date_end):
+    """ The (share table, real transaction table) html of every user profile in the queryset, keyed on
+    user profile id, for the transactions modified in the date range. Runs the same four queries for
+    one user profile or for all of them, and groups the rows per user profile in Python. """
+    cohort = userprofiles.values('id')
+    cohort_ids = set(userprofiles.values_list('id', flat=True))
+
+    consumer_rows = TransactionConsumer.objects.filter(
+        _modified_in_range(date_start, date_end, 'transaction__'),
+        userprofile_id__in=cohort
+    )
+    consumer_amounts = defaultdict(dict)
+    for transaction_id, userprofile_id, amount in consumer_rows.values_list('transaction_id', 'userprofile_id', 'amount'):
+        consumer_amounts[transaction_id][userprofile_id] = amount
 
-    transactions_in_timerange = []
-    for transaction in transactions_all:
-        if (transaction.last_modified.date() > date_start) and (transaction.last_modified.date() < date_end + timedelta(1)):
-            transactions_in_timerange.append(transaction)
+    transactions = Transaction.objects.filter(
+        _modified_in_range(date_start, date_end),
+        Q(buyer_id__in=cohort) | Q(id__in=consumer_rows.values('transaction_id'))
+    ).select_related('buyer').order_by('-last_modified', '-id')
+    shares = defaultdict(list)
+    for transaction in transactions:
+        amounts = consumer_amounts[transaction.id]
+        for userprofile_id in cohort_ids.intersection(set(amounts) | {transaction.buyer_id}):
+            # what the share adds to the balance of the user profile, as amount_per_person in the history
+            amount_per_person = float(transaction.amount) if userprofile_id == transaction.buyer_id else 0.0
+            amount_per_person -= float(amounts.get(userprofile_id, 0))
+            shares[userprofile_id].append(('%.2f' % amount_per_person, transaction))
 
-    if not transactions_in_timerange:
+    transactions_real = TransactionReal.objects.filter(
+        _modified_in_range(date_start, date_end),
+        Q(sender_id__in=cohort) | Q(receiver_id__in=cohort)
+    ).select_related('sender', 'receiver').order_by('-last_modified', '-id')
+    real_transactions = defaultdict(list)
+    for transaction in transactions_real:
+        for userprofile_id in cohort_ids.intersection({transaction.sender_id, transaction.receiver_id}):
+            real_transactions[userprofile_id].append(transaction)
+
+    return {
+        userprofile_id: (
+            create_transaction_history_table_html(shares[userprofile_id]),
+            create_transaction_real_history_table_html(real_transactions[userprofile_id])
+        )
+        for userprofile_id in set(shares) | set(real_transactions)
+    }
+
+
+def create_transaction_history_table_html(shares):
+    """ Table of (amount per person, share) pairs """
+    if not shares:
         return ''
     transaction_table = '<table>'
     transaction_table += '<tr align=\'left\'>'
@@ -21,9 +73,9 @@ def create_transaction_history_table_html(userprofile, date_start, date_end):
     transaction_table += '<th><b>What</b></th>'
     transaction_table += '<th><b>Who</b></th>'
     transaction_table += '<th><b>Date</b></th>'
-    for transaction in transactions_in_timerange:
+    for amount_per_person, transaction in shares:
         transaction_table += '<tr style="font-size: 12px">'
-        transaction_table += '<td>&#8364;' + transaction.amount_per_person + '</td>'
+        transaction_table += '<td>&#8364;' + amount_per_person + '</td>'
         transaction_table += '<td>&#8364;' + '%.2f' % float(transaction.amount) + '</td>'
         transaction_table += '<td>' + transaction.what + '</td>'
         transaction_table += '<td>' + transaction.buyer.displayname + '</td>'
@@ -34,14 +86,8 @@ def create_transaction_history_table_html(userprofile, date_start, date_end):
     return transaction_table
 
 
-def create_transaction_real_history_table_html(userprofile, date_start, date_end):
-    transactionreal_all = TransactionReal.get_transactions_real_sorted_by_last_modified(userprofile.id)
-    transactions_in_timerange = []
-    for transaction in transactionreal_all:
-        if transaction.last_modified.date() > date_start and transaction.last_modified.date() < date_end + timedelta(1):
-            transactions_in_timerange.append(transaction)
-
-    if not transactions_in_timerange:
+def create_transaction_real_history_table_html(transactions_real):
+    if not transactions_real:
         return ''
     transaction_table = '<table style="font-size: 12px">'
     transaction_table += '<tr align=\'left\'>'
@@ -49,7 +95,7 @@ def create_transaction_real_history_table_html(userprofile, date_start, date_end
     transaction_table += '<th><b>From</b></th>'
     transaction_table += '<th><b>To</b></th>'
     transaction_table += '<th><b>Date</b></th>'
-    for transaction in transactions_in_timerange:
+    for transaction in transactions_real:
         transaction_table += '<tr>'
         transaction_table += '<td>&#8364;' + '%.2f' % float(transaction.amount) + '</td>'
         transaction_table += '<td>' + transaction.sender.displayname + '</td>'
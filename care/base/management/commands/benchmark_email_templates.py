@@ -0,0 +1,58 @@
+import datetime
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from care.base import emailserver
+
+
+def render_by_replace(template_name, context):
+    """ The way the emails were rendered before: read the file and replace the placeholders one by one """
+    message = ''
+    with open(os.path.join(emailserver.module_dir, template_name), 'r') as filein:
+        for row in filein.readlines():
+            message += row
+    for name, value in context.items():
+        message = message.replace('{{ ' + name + ' }}', value)
+    return message
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks rendering the email templates with the cached template engine against file reads and replaces'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        table = '<table>' + '<tr><td>share</td><td>12.50</td></tr>' * 50 + '</table>'
+        today = datetime.date.today().strftime('%d %B %Y')
+        contexts = {
+            'welcomemail.html': {'username': 'someone', 'email': 'someone@example.com'},
+            'invitemail.html': {'usernameTo': 'someone', 'usernameFrom': 'other', 'groupName': 'house'},
+            'balancereminder.html': {'username': 'someone', 'group_name': 'house',
+                                     'group_user_balance': '-120.00', 'lower_limit': '-100'},
+            'transactionhistorymail.html': {'username': 'someone', 'transactionTable': table,
+                                            'transactionRealTable': table, 'startDate': today, 'endDate': today},
+        }
+        for template_name, context in contexts.items():
+            engine_context = dict(context)
+            for name in ('transactionTable', 'transactionRealTable'):
+                if name in engine_context:
+                    engine_context[name] = emailserver.mark_safe(engine_context[name])
+            if emailserver.render_email(template_name, engine_context) != render_by_replace(template_name, context):
+                raise CommandError(template_name + ' renders differently with the template engine')
+
+            start = time.time()
+            for i in range(options['renders']):
+                render_by_replace(template_name, context)
+            replace_duration = time.time() - start
+
+            start = time.time()
+            for i in range(options['renders']):
+                emailserver.render_email(template_name, engine_context)
+            engine_duration = time.time() - start
+
+            self.stdout.write('%-28s %d renders: read and replace %.3fs, cached template %.3fs' % (
+                template_name, options['renders'], replace_duration, engine_duration
+            ))
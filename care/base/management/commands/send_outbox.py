@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from care.base.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = 'Sends the due emails of the outbox in batches, one connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-batches', type=int, default=100,
+                            help='stop after this many batches, the rest is sent by a next run')
+        parser.add_argument('--backend',
+                            help='email backend to send with instead of EMAIL_BACKEND, for example '
+                                 'django.core.mail.backends.console.EmailBackend to try it offline')
+
+    def handle(self, *args, **options):
+        tried = 0
+        for batch in range(options['max_batches']):
+            n_emails = OutgoingEmail.send_batch(options['batch_size'], options['backend'])
+            if n_emails == 0:
+                break
+            tried += n_emails
+        counts = dict(OutgoingEmail.objects.values_list('status').annotate(Count('id')).order_by())
+        self.stdout.write('tried %d emails, outbox: %d pending, %d sent, %d failed' % (
+            tried,
+            counts.get(OutgoingEmail.PENDING, 0),
+            counts.get(OutgoingEmail.SENT, 0),
+            counts.get(OutgoingEmail.FAILED, 0),
+        ))
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:48
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_to', models.CharField(max_length=254)),
+                ('email_from', models.CharField(max_length=254)),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=datetime.datetime.now)),
+                ('claim', models.CharField(blank=True, editable=False, max_length=32)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=datetime.datetime.now)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(fields=['status', 'next_attempt'], name='outbox_due_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=100)),
+                ('shard', models.PositiveIntegerField()),
+                ('owner', models.CharField(blank=True, editable=False, max_length=32)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('completed_period', models.BigIntegerField(blank=True, null=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('job', 'shard')},
+            },
+        ),
+    ]
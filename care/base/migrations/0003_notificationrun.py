@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:00
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groupaccount', '0003_remove_groupaccount_number'),
+        ('userprofile', '0001_initial'),
+        ('base', '0002_shardlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=100)),
+                ('shard', models.PositiveIntegerField(default=0)),
+                ('period', models.BigIntegerField()),
+                ('cursor', models.PositiveIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('queued', models.PositiveIntegerField(default=0)),
+                ('duration', models.FloatField(default=0.0)),
+                ('started', models.DateTimeField(default=datetime.datetime.now)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('job', 'shard', 'period')},
+            },
+        ),
+        migrations.CreateModel(
+            name='NotificationRecipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('nothing', 'nothing to send')], max_length=10)),
+                ('group_account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='groupaccount.GroupAccount')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='base.NotificationRun')),
+                ('userprofile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='userprofile.UserProfile')),
+            ],
+        ),
+    ]
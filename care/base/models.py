@@ -0,0 +1,238 @@
+import datetime
+import logging
+import time
+import uuid
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import models, transaction as db_transaction
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+
+class OutgoingEmail(models.Model):
+    """ An email in the outbox. Emails are queued here instead of being sent in the request or
+    cron job that creates them, and are sent in batches by send_outbox / SendOutgoingEmails. """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (SENT, 'sent'),
+        (FAILED, 'failed'),
+    )
+    MAX_ATTEMPTS = 6
+    RETRY_DELAY = datetime.timedelta(minutes=5)  # doubled after every failed attempt
+    CLAIM_DURATION = datetime.timedelta(minutes=10)
+
+    email_to = models.CharField(max_length=254)
+    email_from = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now)
+    claim = models.CharField(max_length=32, blank=True, editable=False)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(default=datetime.datetime.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='outbox_due_idx'),
+        ]
+
+    @staticmethod
+    def queue(email_to, email_from, subject, message):
+        return OutgoingEmail.objects.create(email_to=email_to, email_from=email_from, subject=subject, message=message)
+
+    @staticmethod
+    def claim_batch(batch_size, now):
+        """ Claims up to batch_size due emails, other workers skip them until the claim expires """
+        claim = uuid.uuid4().hex
+        due = OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING, next_attempt__lte=now)
+        ids = list(due.order_by('next_attempt', 'id').values_list('id', flat=True)[:batch_size])
+        due.filter(id__in=ids).update(claim=claim, next_attempt=now + OutgoingEmail.CLAIM_DURATION)
+        return list(OutgoingEmail.objects.filter(claim=claim).order_by('id'))
+
+    @staticmethod
+    def send_batch(batch_size=50, backend=None):
+        """ Sends a batch of due emails over one connection and returns the number of emails it tried """
+        now = datetime.datetime.now()
+        emails = OutgoingEmail.claim_batch(batch_size, now)
+        if not emails:
+            return 0
+        connection = get_connection(backend)
+        try:
+            connection.open()
+        except Exception as error:
+            logger.exception('cannot open the email connection')
+            for email in emails:
+                email.retry_later(error, now)
+            return len(emails)
+        try:
+            for email in emails:
+                try:
+                    # send_messages returns the number sent, a message it rejects counts as failed
+                    if connection.send_messages([email.to_message(connection)]) != 1:
+                        raise ValueError('the message was not accepted')
+                except Exception as error:
+                    email.retry_later(error, now)
+                else:
+                    email.mark_sent(now)
+        finally:
+            connection.close()
+        return len(emails)
+
+    def to_message(self, connection):
+        return EmailMessage(self.subject, self.message, self.email_from, [self.email_to], connection=connection)
+
+    def mark_sent(self, now):
+        self.status = OutgoingEmail.SENT
+        self.attempts += 1
+        self.sent = now
+        self.claim = ''
+        self.save()
+
+    def retry_later(self, error, now):
+        self.attempts += 1
+        self.last_error = str(error)
+        self.claim = ''
+        if self.attempts >= OutgoingEmail.MAX_ATTEMPTS:
+            self.status = OutgoingEmail.FAILED
+            logger.error('giving up on email ' + str(self.id) + ' to ' + self.email_to + ': ' + self.last_error)
+        else:
+            self.next_attempt = now + OutgoingEmail.RETRY_DELAY * 2 ** (self.attempts - 1)
+            logger.warning('email ' + str(self.id) + ' to ' + self.email_to + ' failed, retrying at ' + str(self.next_attempt))
+        self.save()
+
+    def __str__(self):
+        return self.subject + ' to ' + self.email_to
+
+
+class ShardLock(models.Model):
+    """ Lock and last run of one shard of a sharded cron job, see care.base.shards.
+    A run takes the lock with a conditional update, so overlapping runs never work on the same shard,
+    and a shard completed in a period is skipped by later runs in that period. """
+    LOCK_DURATION = datetime.timedelta(hours=2)  # a crashed run keeps the shard at most this long
+
+    job = models.CharField(max_length=100)
+    shard = models.PositiveIntegerField()
+    owner = models.CharField(max_length=32, blank=True, editable=False)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    completed_period = models.BigIntegerField(null=True, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # seconds of the last completed run
+
+    class Meta:
+        unique_together = ('job', 'shard')
+
+    @staticmethod
+    def acquire(job, shard, period, now):
+        """ Locks the shard for a run in period, returns the owner token or None if the shard is locked
+        by another run or was already completed in period """
+        ShardLock.objects.get_or_create(job=job, shard=shard)
+        owner = uuid.uuid4().hex
+        locked = ShardLock.objects.filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lte=now),
+            Q(completed_period__isnull=True) | ~Q(completed_period=period),
+            job=job,
+            shard=shard,
+        ).update(owner=owner, locked_until=now + ShardLock.LOCK_DURATION, started=now)
+        if not locked:
+            return None
+        return owner
+
+    @staticmethod
+    def release(job, shard, owner, period, duration):
+        """ Unlocks the shard, marking it completed in period unless period is None (the run failed) """
+        values = {'owner': '', 'locked_until': None}
+        if period is not None:
+            values.update(completed_period=period, finished=datetime.datetime.now(), duration=duration)
+        ShardLock.objects.filter(job=job, shard=shard, owner=owner).update(**values)
+
+    def __str__(self):
+        return self.job + ' shard ' + str(self.shard)
+
+
+class NotificationRun(models.Model):
+    """ Progress of a notification job (one shard of it) in one period. The rows are walked in id order
+    and the cursor is saved with the emails of every batch, so a run that stopped halfway resumes after
+    the last batch it queued instead of mailing everyone again or no one. """
+    job = models.CharField(max_length=100)
+    shard = models.PositiveIntegerField(default=0)
+    period = models.BigIntegerField()
+    cursor = models.PositiveIntegerField(default=0)  # id of the last processed row
+    processed = models.PositiveIntegerField(default=0)
+    queued = models.PositiveIntegerField(default=0)
+    duration = models.FloatField(default=0.0)  # seconds spent processing, summed over resumes
+    started = models.DateTimeField(default=datetime.datetime.now)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('job', 'shard', 'period')
+
+    @property
+    def throughput(self):
+        """ Rows processed per second """
+        if self.duration == 0.0:
+            return 0.0
+        return self.processed / self.duration
+
+    @staticmethod
+    def resume(job, shard, period):
+        """ The run of the job shard in period, a new one if it did not start yet """
+        run, created = NotificationRun.objects.get_or_create(job=job, shard=shard, period=period)
+        if not created and run.finished is None:
+            logger.info('resuming ' + str(run) + ' after row ' + str(run.cursor))
+        return run
+
+    def process(self, rows, prepare, batch_size=500):
+        """ Walks the rows queryset from the cursor in batches. prepare(batch) returns an (unsaved recipient,
+        unsaved email or None) pair for every row of the batch, and should only read from the database.
+        The emails, recipients and cursor of a batch are saved in one database transaction. """
+        while self.finished is None:
+            start = time.time()
+            batch = list(rows.filter(id__gt=self.cursor).order_by('id')[:batch_size])
+            if not batch:
+                self.finished = datetime.datetime.now()
+                self.save()
+                break
+            prepared = prepare(batch)
+            emails = [email for recipient, email in prepared if email is not None]
+            for recipient, email in prepared:
+                recipient.run = self
+                recipient.status = NotificationRecipient.QUEUED if email is not None else NotificationRecipient.NOTHING
+            with db_transaction.atomic():
+                OutgoingEmail.objects.bulk_create(emails)
+                NotificationRecipient.objects.bulk_create([recipient for recipient, email in prepared])
+                self.cursor = batch[-1].id
+                self.processed += len(batch)
+                self.queued += len(emails)
+                self.duration += time.time() - start
+                self.save()
+        logger.info(str(self) + ': ' + str(self.processed) + ' processed, ' + str(self.queued) + ' queued, '
+                    + '%.1f' % self.throughput + ' per second')
+        return self
+
+    def __str__(self):
+        return self.job + ' shard ' + str(self.shard) + ' period ' + str(self.period)
+
+
+class NotificationRecipient(models.Model):
+    """ A user profile (in a group account, for reminders) a NotificationRun processed """
+    QUEUED = 'queued'
+    NOTHING = 'nothing'
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (NOTHING, 'nothing to send'),
+    )
+
+    run = models.ForeignKey(NotificationRun, related_name='recipients', on_delete=models.CASCADE)
+    userprofile = models.ForeignKey('userprofile.UserProfile', on_delete=models.CASCADE)
+    group_account = models.ForeignKey('groupaccount.GroupAccount', null=True, blank=True, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+
+    def __str__(self):
+        return str(self.userprofile_id) + ' in ' + str(self.run) + ': ' + self.status
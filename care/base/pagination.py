@@ -0,0 +1,160 @@
+import heapq
+import logging
+
+from django.db.models import Q, prefetch_related_objects
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class KeysetPage(object):
+    """ One page of a KeysetPaginator, iterable like a list of objects """
+
+    def __init__(self, keyed_objects, has_next, has_previous):
+        self.object_list = [obj for key, obj in keyed_objects]
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = ''
+        self.previous_cursor = ''
+        if keyed_objects:
+            self.previous_cursor = KeysetPaginator.encode_cursor(keyed_objects[0][0])
+            self.next_cursor = KeysetPaginator.encode_cursor(keyed_objects[-1][0])
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class KeysetSource(object):
+    """ A queryset walked on a (last_modified, id) key, newest or oldest first.
+
+    The key is read from the attributes last_modified and id of the rows, by default the fields of
+    the model. A source can name annotations holding the same values instead, such as the copy of
+    last_modified on a join table, so the walk follows an index on that table instead of sorting.
+    The prefetch lookups are not part of the queryset, see prefetch_page.
+    """
+
+    def __init__(self, queryset, last_modified='last_modified', id='id', prefetch=()):
+        self.queryset = queryset
+        self.last_modified = last_modified
+        self.id = id
+        self.prefetch = prefetch
+
+    def annotate(self, **annotations):
+        return KeysetSource(self.queryset.annotate(**annotations), self.last_modified, self.id, self.prefetch)
+
+    def key(self, obj):
+        return getattr(obj, self.last_modified), getattr(obj, self.id)
+
+    def walk(self, newer, cursor=None, inclusive=False):
+        """ The rows newer (or older) than the (last_modified, id) cursor in the order they are walked,
+        the row at the cursor itself included if inclusive, or all rows without a cursor """
+        if newer:
+            queryset = self.queryset.order_by(self.last_modified, self.id)
+        else:
+            queryset = self.queryset.order_by('-' + self.last_modified, '-' + self.id)
+        if cursor is None:
+            return queryset
+        last_modified, object_id = cursor
+        lookup = '__gt' if newer else '__lt'
+        position = Q(**{self.last_modified + lookup: last_modified}) | Q(**{
+            self.last_modified: last_modified, self.id + lookup: object_id
+        })
+        if inclusive:
+            position |= Q(**{self.last_modified: last_modified, self.id: object_id})
+        return queryset.filter(position)
+
+
+def prefetch_page(objects, sources):
+    """ Runs the prefetch lookups of the sources on the objects of a page taken from them, once per model
+    instead of once per source, and only for the rows that are shown """
+    prefetches = {}
+    for source in sources:
+        prefetches.setdefault(source.queryset.model, source.prefetch)
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(type(obj), []).append(obj)
+    for model, model_objects in by_model.items():
+        prefetch_related_objects(model_objects, *prefetches.get(model, ()))
+    return objects
+
+
+class KeysetPaginator(object):
+    """ Paginates the merge of one or more KeysetSources (or querysets), newest first on (last_modified, id).
+
+    Instead of an offset, a page continues from a cursor: the (last_modified, id, source)
+    key of the last or first row shown. Every source is filtered on that key and limited
+    in SQL, so a page costs O(per_page) rows no matter how deep in the history it is.
+    """
+
+    def __init__(self, sources, per_page):
+        self.sources = [source if isinstance(source, KeysetSource) else KeysetSource(source) for source in sources]
+        self.per_page = per_page
+
+    @staticmethod
+    def encode_cursor(key):
+        last_modified, object_id, source = key
+        return last_modified.isoformat() + '_' + str(object_id) + '_' + str(source)
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """ Returns the (last_modified, id, source) key of a cursor, or None if it is not valid """
+        try:
+            last_modified, object_id, source = cursor.split('_')
+            last_modified = parse_datetime(last_modified)
+            if last_modified is None:
+                return None
+            return last_modified, int(object_id), int(source)
+        except (AttributeError, ValueError):
+            return None
+
+    def page(self, after=None, before=None):
+        """ The page after (older than) or before (newer than) a cursor, or the first page """
+        after = self.decode_cursor(after)
+        before = self.decode_cursor(before)
+        if before is not None:
+            keyed_objects = self._fetch(before, newer=True)
+            if keyed_objects:
+                has_previous = len(keyed_objects) > self.per_page
+                keyed_objects = list(reversed(keyed_objects[:self.per_page]))
+                return self._page(keyed_objects, has_next=True, has_previous=has_previous)
+        keyed_objects = self._fetch(after, newer=False)
+        return self._page(
+            keyed_objects[:self.per_page],
+            has_next=len(keyed_objects) > self.per_page,
+            has_previous=after is not None
+        )
+
+    def _page(self, keyed_objects, has_next, has_previous):
+        prefetch_page([obj for key, obj in keyed_objects], self.sources)
+        return KeysetPage(keyed_objects, has_next, has_previous)
+
+    def _fetch(self, cursor, newer):
+        """ Up to per_page + 1 rows next to the cursor, in the order they are walked """
+        iterators = []
+        for index, source in enumerate(self.sources):
+            if cursor is None:
+                rows = source.walk(newer)
+            else:
+                # the source breaks ties between rows with the same (last_modified, id) in different sources
+                cursor_index = cursor[2]
+                inclusive = index < cursor_index if newer else index > cursor_index
+                rows = source.walk(newer, cursor[:2], inclusive)
+            iterators.append([(source.key(obj) + (index,), obj) for obj in rows[:self.per_page + 1]])
+
+        merged = heapq.merge(
+            *iterators,
+            key=lambda keyed_object: (keyed_object[0][0], keyed_object[0][1], -keyed_object[0][2]),
+            reverse=not newer
+        )
+        keyed_objects = []
+        for keyed_object in merged:
+            keyed_objects.append(keyed_object)
+            if len(keyed_objects) > self.per_page:
+                break
+        return keyed_objects
@@ -0,0 +1,75 @@
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models.functions import Mod
+
+from care.base.models import ShardLock
+
+logger = logging.getLogger(__name__)
+
+N_SHARDS = 8
+MAX_WORKERS = 4
+
+
+def in_shard(queryset, field, shard, n_shards):
+    """ The rows of queryset whose integer field falls in the shard """
+    if n_shards == 1:
+        return queryset
+    return queryset.annotate(shard=Mod(field, n_shards)).filter(shard=shard)
+
+
+def current_period(every, now):
+    """ Number of the period of length every that now is in, counted from the epoch """
+    return int((now - datetime.datetime(1970, 1, 1)) / every)
+
+
+def _run_shard(job, work, shard, n_shards, period):
+    now = datetime.datetime.now()
+    owner = ShardLock.acquire(job, shard, period, now)
+    if owner is None:
+        return None
+    start = time.time()
+    completed_period = None
+    try:
+        result = work(shard, n_shards, period)
+        completed_period = period
+        return time.time() - start, result
+    finally:
+        ShardLock.release(job, shard, owner, completed_period, time.time() - start)
+        # every worker thread has its own database connection
+        connection.close()
+
+
+def run_sharded(job, work, every, n_shards=N_SHARDS, max_workers=MAX_WORKERS):
+    """ Runs work(shard, n_shards, period) for every shard of the job on a thread pool and returns the
+    (duration, result) of each shard this run processed, keyed on shard.
+
+    A shard is locked while it runs and skipped by other runs in the same period of length every,
+    so overlapping cron invocations never process a shard twice. A shard that raised is unlocked
+    without being completed, the next run of the period retries it. Raises when not every shard is
+    completed in the period, so django_cron logs the job as failed and runs it again. """
+    period = current_period(every, datetime.datetime.now())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            shard: executor.submit(_run_shard, job, work, shard, n_shards, period)
+            for shard in range(n_shards)
+        }
+    timings = {}
+    for shard, future in futures.items():
+        try:
+            timing = future.result()
+        except Exception:
+            logger.exception(job + ' shard ' + str(shard) + ' failed')
+            continue
+        if timing is None:
+            logger.info(job + ' shard ' + str(shard) + ' skipped, it is locked or done')
+            continue
+        timings[shard] = timing
+        logger.info(job + ' shard ' + str(shard) + ' took ' + '%.3f' % timing[0] + 's: ' + str(timing[1]))
+    n_completed = ShardLock.objects.filter(job=job, completed_period=period, shard__lt=n_shards).count()
+    if n_completed < n_shards:
+        raise RuntimeError(job + ': ' + str(n_shards - n_completed) + ' shards are not completed yet')
+    return timings
@@ -1,13 +1,17 @@
+import hashlib
 import logging
 
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
 
 from registration.backends.simple.views import RegistrationView
 
+from care.base.activity import activity_sources, get_latest_activity
+from care.base.pagination import KeysetPaginator
+from care.groupaccount import groupcache
 from care.groupaccount.models import GroupAccount
 from care.groupaccountinvite.models import GroupAccountInvite
-from care.transaction.models import Transaction
-from care.transaction.models import TransactionReal
+from care.transaction.models import HistoryVersion, Transaction
 from care.userprofile.models import UserProfile
 
 logger = logging.getLogger(__name__)
@@ -18,8 +22,7 @@ class BaseView(TemplateView):
     context_object_name = "base"
 
     def get_userprofile(self):
-        user = self.request.user
-        return UserProfile.objects.get(user=user)
+        return self.request.userprofile
 
     def get_active_menu(self):
         return ''
@@ -28,18 +31,49 @@ class BaseView(TemplateView):
         # Call the base implementation first to get a context
         context = super().get_context_data(**kwargs)
         if self.request.user.is_authenticated:
-            user_profile = UserProfile.objects.get(user=self.request.user)
-            invites = GroupAccountInvite.objects.filter(invitee=user_profile, isAccepted=False, isDeclined=False)
+            user_profile = self.request.userprofile
+            n_invites = GroupAccountInvite.get_open_invites_count(user_profile.id)
             context['user'] = self.request.user
             context['userprofile'] = user_profile
-            context['hasInvites'] = invites.exists()
-            context['nInvites'] = invites.count()
+            context['hasInvites'] = n_invites > 0
+            context['nInvites'] = n_invites
             context['displayname'] = user_profile.displayname
             context['activeMenu'] = self.get_active_menu()
             context['isLoggedin'] = True
         return context
 
 
+class ConditionalView(BaseView):
+    """ A page that answers 304 Not Modified to a GET with a matching ETag, before building its context.
+    The ETag covers the page header, the table view asked for in the url, the cache versions of the
+    groups of the user and the history versions of the user and its groups, subclasses add the
+    version of whatever else they show. Building it writes nothing, the table view preference is
+    stored by get_context_data. """
+
+    def get_etag_parts(self):
+        user_profile = self.get_userprofile()
+        group_account_ids = sorted(user_profile.group_accounts.values_list('id', flat=True))
+        versions = groupcache.get_versions(group_account_ids)
+        return [
+            user_profile.id,
+            user_profile.displayname,
+            user_profile.requested_show_table(self.kwargs.get('tableView', 0)),
+            GroupAccountInvite.get_open_invites_count(user_profile.id),
+            [(group_account_id, versions[group_account_id]) for group_account_id in group_account_ids],
+            HistoryVersion.get_versions(user_profile.id, group_account_ids),
+            self.request.GET.urlencode(),
+        ]
+
+    def get_etag(self):
+        return hashlib.md5(repr(self.get_etag_parts()).encode()).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        @condition(etag_func=lambda request, *args, **kwargs: self.get_etag())
+        def respond(request, *args, **kwargs):
+            return super(ConditionalView, self).dispatch(request, *args, **kwargs)
+        return respond(request, *args, **kwargs)
+
+
 class NewRegistrationView(RegistrationView):
     success_url = '/'
 
@@ -60,14 +94,10 @@ class HomeView(BaseView):
         context = super().get_context_data(**kwargs)
         user_profile = self.get_userprofile()
 
-        group_accounts = user_profile.group_accounts.all()
+        group_accounts = list(user_profile.group_accounts.select_related('settings__notification_lower_limit_interval'))
         friends = UserProfile.objects.filter(group_accounts__in=group_accounts).distinct()
 
-        transactions_all_sorted = Transaction.get_transactions_sorted_by_last_modified(user_profile.id)
-        transactionsreal_all_sorted = TransactionReal.get_transactions_real_sorted_by_last_modified(user_profile.id)
-
-        for group_account in group_accounts:
-            GroupAccount.add_groupaccount_info(group_account, user_profile)
+        GroupAccount.add_groupaccounts_info(group_accounts, user_profile)
 
         my_total_balance_float = 0.0
         for group_account in group_accounts:
@@ -77,16 +107,30 @@ class HomeView(BaseView):
         context['my_total_balance'] = my_total_balance_str
         context['my_total_balance_float'] = my_total_balance_float
 #     invitesAllSorted = GroupAccountInvite.get_invites_sorted_by_date(userProfile)
-        slowlastn = 5
+        slowlastn = 10
 #     context['invitesAll'] = invitesAllSorted[0:slowLastN]
         context['friends'] = friends
-        context['transactions_all'] = transactions_all_sorted[0:slowlastn]
-        context['transactionsreal_all'] = transactionsreal_all_sorted[0:slowlastn]
+        context['activities'] = get_latest_activity(user_profile.id, slowlastn)
         context['groups'] = group_accounts
         context['homesection'] = True
         return context
 
 
+class ActivityView(BaseView):
+    template_name = "base/activity.html"
+    context_object_name = "activity"
+
+    def get_active_menu(self):
+        return 'account'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        user_profile = self.get_userprofile()
+        paginator = KeysetPaginator(activity_sources(user_profile.id), 25)
+        context['activities'] = paginator.page(self.request.GET.get('after'), self.request.GET.get('before'))
+        return context
+
+
 class AboutView(BaseView):
     template_name = "base/about.html"
     context_object_name = "about"
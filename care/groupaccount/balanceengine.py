@@ -0,0 +1,125 @@
+import logging
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+class GroupBalanceEngine(object):
+    """ Computes the balances, share statistics and who-owes-whom matrix of a group
+    from flat arrays, with vectorized reductions instead of per-member aggregates.
+
+    The share arrays have one entry per (share, consumer): transaction id, amount, buyer id
+    and consumer id, where the consumer id is -1 for a share without consumers. The optional
+    consumer amounts are the stored parts of the consumers, without them shares are split equally.
+    The real arrays have one entry per real transaction: sender id, receiver id and amount.
+    """
+
+    def __init__(self, member_ids, transaction_ids, amounts, buyer_ids, consumer_ids,
+                 sender_ids, receiver_ids, real_amounts, consumer_amounts=None):
+        self.compute(member_ids, transaction_ids, amounts, buyer_ids, consumer_ids,
+                     sender_ids, receiver_ids, real_amounts, consumer_amounts)
+
+    @staticmethod
+    def from_rows(member_ids, share_rows, real_rows):
+        """ Share rows are (transaction id, amount, buyer id, consumer id, consumer amount) """
+        share_columns = list(zip(*share_rows)) or [(), (), (), (), ()]
+        real_columns = list(zip(*real_rows)) or [(), (), ()]
+        transaction_ids, amounts, buyer_ids, consumer_ids, consumer_amounts = share_columns
+        sender_ids, receiver_ids, real_amounts = real_columns
+        return GroupBalanceEngine(
+            numpy.array(list(member_ids), dtype=numpy.int64),
+            numpy.array(transaction_ids, dtype=numpy.int64),
+            numpy.array([float(amount) for amount in amounts], dtype=numpy.float64),
+            numpy.array(buyer_ids, dtype=numpy.int64),
+            numpy.array([-1 if consumer_id is None else consumer_id for consumer_id in consumer_ids], dtype=numpy.int64),
+            numpy.array(sender_ids, dtype=numpy.int64),
+            numpy.array(receiver_ids, dtype=numpy.int64),
+            numpy.array([float(amount) for amount in real_amounts], dtype=numpy.float64),
+            numpy.array([0.0 if amount is None else float(amount) for amount in consumer_amounts], dtype=numpy.float64),
+        )
+
+    @staticmethod
+    def for_group_account(group_account_id):
+        """ Fetches the rows of a group with two queries and returns the engine for them """
+        from care.transaction.models import Transaction, TransactionReal
+        from care.userprofile.models import UserProfile
+
+        member_ids = UserProfile.objects.filter(group_accounts=group_account_id).values_list('id', flat=True)
+        share_rows = Transaction.objects.filter(
+            group_account_id=group_account_id
+        ).values_list(
+            'id', 'amount', 'buyer_id', 'transactionconsumer__userprofile_id', 'transactionconsumer__amount'
+        ).order_by()
+        real_rows = TransactionReal.objects.filter(
+            group_account_id=group_account_id
+        ).values_list('sender_id', 'receiver_id', 'amount').order_by()
+        return GroupBalanceEngine.from_rows(member_ids, share_rows, real_rows)
+
+    def compute(self, member_ids, transaction_ids, amounts, buyer_ids, consumer_ids,
+                sender_ids, receiver_ids, real_amounts, consumer_amounts=None):
+        self.user_profile_ids = numpy.unique(numpy.concatenate([
+            member_ids, buyer_ids, consumer_ids[consumer_ids >= 0], sender_ids, receiver_ids
+        ]))
+        n = len(self.user_profile_ids)
+
+        # one entry per share, for the buyer side
+        unique_transactions, first_row, row_transaction = numpy.unique(
+            transaction_ids, return_index=True, return_inverse=True
+        )
+        buyers = numpy.searchsorted(self.user_profile_ids, buyer_ids[first_row])
+        self.n_trans_buyer = numpy.bincount(buyers, minlength=n)
+        self.total_bought = numpy.bincount(buyers, weights=amounts[first_row], minlength=n)
+
+        # one entry per (share, consumer), each consumes its stored part or an equal part of the share
+        has_consumer = consumer_ids >= 0
+        consumers = numpy.searchsorted(self.user_profile_ids, consumer_ids[has_consumer])
+        if consumer_amounts is None:
+            n_consumers = numpy.bincount(row_transaction, weights=has_consumer, minlength=len(unique_transactions))
+            amount_per_person = amounts[has_consumer] / n_consumers[row_transaction[has_consumer]]
+        else:
+            amount_per_person = consumer_amounts[has_consumer]
+        self.n_trans_consumer = numpy.bincount(consumers, minlength=n)
+        self.total_consumed = numpy.bincount(consumers, weights=amount_per_person, minlength=n)
+
+        senders = numpy.searchsorted(self.user_profile_ids, sender_ids)
+        receivers = numpy.searchsorted(self.user_profile_ids, receiver_ids)
+        self.total_sent = numpy.bincount(senders, weights=real_amounts, minlength=n)
+        self.total_received = numpy.bincount(receivers, weights=real_amounts, minlength=n)
+
+        self.balances = self.total_bought + self.total_sent - self.total_consumed - self.total_received
+
+        # owes[i, j] is what i owes j: a consumer owes the buyer its part,
+        # and a receiver of a real transaction owes the sender the amount
+        debtors = numpy.concatenate([consumers, receivers])
+        creditors = numpy.concatenate([buyers[row_transaction[has_consumer]], senders])
+        weights = numpy.concatenate([amount_per_person, real_amounts])
+        owes = numpy.bincount(debtors * n + creditors, weights=weights, minlength=n * n).reshape(n, n)
+        self.debt_matrix = numpy.clip(owes - owes.T, 0.0, None)
+
+    def get_index(self, user_profile_id):
+        """ Position of a user profile in the result arrays, or None if it has no part in the group """
+        index = int(numpy.searchsorted(self.user_profile_ids, user_profile_id))
+        if index == len(self.user_profile_ids) or self.user_profile_ids[index] != user_profile_id:
+            return None
+        return index
+
+    def get_balance(self, user_profile_id):
+        index = self.get_index(user_profile_id)
+        if index is None:
+            return 0.0
+        return float(self.balances[index])
+
+    def get_balances(self):
+        """ Balances keyed on user profile id """
+        return dict(zip(self.user_profile_ids.tolist(), self.balances.tolist()))
+
+    def get_debts(self, min_amount=0.005):
+        """ (debtor id, creditor id, amount) for every pair where the debtor owes the creditor, largest first """
+        debtors, creditors = numpy.nonzero(self.debt_matrix >= min_amount)
+        amounts = self.debt_matrix[debtors, creditors]
+        order = numpy.argsort(-amounts, kind='stable')
+        return [
+            (int(self.user_profile_ids[debtors[i]]), int(self.user_profile_ids[creditors[i]]), float(amounts[i]))
+            for i in order
+        ]
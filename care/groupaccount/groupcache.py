@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'groupaccount:%d:version'
+DATA_KEY = 'groupaccount:%d:%d:%s'
+HITS_KEY = 'groupaccount:cache:hits'
+MISSES_KEY = 'groupaccount:cache:misses'
+TIMEOUT = 24 * 60 * 60
+# lookups a process counts before it adds its hits and misses to the shared counters
+STATS_FLUSH_EVERY = 200
+
+_stats_lock = threading.Lock()
+_pending_stats = {HITS_KEY: 0, MISSES_KEY: 0}
+
+
+def _new_version():
+    # time based, so a version key that was evicted never comes back as a version that is still cached
+    return int(time.time() * 1000000)
+
+
+def get_versions(group_account_ids):
+    """ Current cache version of each group account, keyed on group account id """
+    keys = {group_account_id: VERSION_KEY % group_account_id for group_account_id in group_account_ids}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for group_account_id, key in keys.items():
+        if key not in found:
+            cache.add(key, _new_version(), None)
+            found[key] = cache.get(key)
+        versions[group_account_id] = found[key]
+    return versions
+
+
+def bump_versions(group_account_ids):
+    """ Makes everything cached for the group accounts stale, in every process sharing the cache """
+    # a new version instead of incr, incr is a get and a set on the file and database backends
+    # and two processes bumping at once would both end up on the same next version
+    cache.set_many({VERSION_KEY % group_account_id: _new_version() for group_account_id in set(group_account_ids)}, None)
+
+
+def _count(hits, misses):
+    """ Counts the lookup in this process, the shared counters are only written every STATS_FLUSH_EVERY
+    lookups, so a cached read does not also write to the cache """
+    with _stats_lock:
+        _pending_stats[HITS_KEY] += hits
+        _pending_stats[MISSES_KEY] += misses
+        if _pending_stats[HITS_KEY] + _pending_stats[MISSES_KEY] < STATS_FLUSH_EVERY:
+            return
+        pending = dict(_pending_stats)
+        _pending_stats[HITS_KEY] = _pending_stats[MISSES_KEY] = 0
+    _flush_stats(pending)
+
+
+def _flush_stats(pending):
+    for key, n in pending.items():
+        if n == 0:
+            continue
+        try:
+            cache.incr(key, n)
+        except ValueError:
+            cache.set(key, n, None)
+
+
+def flush_stats():
+    """ Adds the hits and misses this process did not flush yet to the shared counters """
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats[HITS_KEY] = _pending_stats[MISSES_KEY] = 0
+    _flush_stats(pending)
+
+
+def get_stats():
+    """ Hits and misses flushed by all processes sharing the cache. Approximate: the lookups a process
+    did not flush yet are missing, and two processes flushing at the same moment can lose a batch. """
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': stats.get(HITS_KEY, 0), 'misses': stats.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    with _stats_lock:
+        _pending_stats[HITS_KEY] = _pending_stats[MISSES_KEY] = 0
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def get_many(kind, group_account_ids, compute_missing):
+    """ Values of kind for the group accounts, keyed on group account id.
+    compute_missing gets the ids that are not cached (or stale) and returns their values as a dict. """
+    versions = get_versions(group_account_ids)
+    keys = {
+        group_account_id: DATA_KEY % (group_account_id, versions[group_account_id], kind)
+        for group_account_id in group_account_ids
+    }
+    found = cache.get_many(list(keys.values()))
+    values = {group_account_id: found[key] for group_account_id, key in keys.items() if key in found}
+    missing = [group_account_id for group_account_id in keys if group_account_id not in values]
+    _count(len(values), len(missing))
+    if missing:
+        computed = compute_missing(missing)
+        cache.set_many({keys[group_account_id]: computed[group_account_id] for group_account_id in missing}, TIMEOUT)
+        values.update(computed)
+    return values
+
+
+def get(kind, group_account_id, compute):
+    return get_many(kind, [group_account_id], lambda missing: {group_account_id: compute()})[group_account_id]
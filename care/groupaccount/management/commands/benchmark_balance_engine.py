@@ -0,0 +1,109 @@
+import time
+from collections import defaultdict
+
+import numpy
+
+from django.core.management.base import BaseCommand, CommandError
+
+from care.groupaccount.balanceengine import GroupBalanceEngine
+from care.userprofile.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the vectorized GroupBalanceEngine against per-member balance computation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, nargs='+', default=[10, 100, 1000],
+                            help='group sizes of the synthetic groups')
+        parser.add_argument('--transactions', type=int, default=100000,
+                            help='number of shares in each synthetic group')
+        parser.add_argument('--group-account', type=int,
+                            help='instead, compare the engine with UserProfile.compute_balance for this group')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['group_account']:
+            self.benchmark_group_account(options['group_account'])
+            return
+        random = numpy.random.RandomState(options['seed'])
+        for n_members in options['members']:
+            self.benchmark_synthetic(random, n_members, options['transactions'])
+
+    def benchmark_synthetic(self, random, n_members, n_transactions):
+        member_ids = numpy.arange(1, n_members + 1, dtype=numpy.int64)
+        n_consumers = random.randint(1, min(n_members, 8) + 1, size=n_transactions)
+        transaction_ids = numpy.repeat(numpy.arange(n_transactions, dtype=numpy.int64), n_consumers)
+        amounts = numpy.repeat(random.randint(1, 10000, size=n_transactions) / 100.0, n_consumers)
+        buyer_ids = numpy.repeat(random.choice(member_ids, size=n_transactions), n_consumers)
+        consumer_ids = random.choice(member_ids, size=len(transaction_ids))
+        # a consumer takes part in a share only once
+        unique_rows = numpy.unique(numpy.stack([transaction_ids, consumer_ids]), axis=1, return_index=True)[1]
+        unique_rows.sort()
+        transaction_ids, amounts = transaction_ids[unique_rows], amounts[unique_rows]
+        buyer_ids, consumer_ids = buyer_ids[unique_rows], consumer_ids[unique_rows]
+        n_real = n_transactions // 10
+        sender_ids = random.choice(member_ids, size=n_real)
+        receiver_ids = random.choice(member_ids, size=n_real)
+        real_amounts = random.randint(1, 10000, size=n_real) / 100.0
+
+        start = time.time()
+        engine = GroupBalanceEngine(member_ids, transaction_ids, amounts, buyer_ids, consumer_ids,
+                                    sender_ids, receiver_ids, real_amounts)
+        engine_duration = time.time() - start
+
+        start = time.time()
+        expected = self.balances_per_member(
+            member_ids.tolist(),
+            list(zip(transaction_ids.tolist(), amounts.tolist(), buyer_ids.tolist(), consumer_ids.tolist())),
+            list(zip(sender_ids.tolist(), receiver_ids.tolist(), real_amounts.tolist())),
+        )
+        loop_duration = time.time() - start
+
+        self.check_balances(engine, expected)
+        self.stdout.write('%5d members, %d shares, %d consumer rows: engine %.3fs, python loop %.3fs (%.1fx)' % (
+            n_members, n_transactions, len(transaction_ids), engine_duration, loop_duration,
+            loop_duration / max(engine_duration, 1e-9)
+        ))
+
+    def benchmark_group_account(self, group_account_id):
+        start = time.time()
+        engine = GroupBalanceEngine.for_group_account(group_account_id)
+        engine_duration = time.time() - start
+
+        start = time.time()
+        member_ids = UserProfile.objects.filter(group_accounts=group_account_id).values_list('id', flat=True)
+        expected = {
+            user_profile_id: UserProfile.compute_balance(group_account_id, user_profile_id)
+            for user_profile_id in member_ids
+        }
+        aggregate_duration = time.time() - start
+
+        self.check_balances(engine, expected)
+        self.stdout.write('group %d, %d members: engine %.3fs, per-member aggregates %.3fs' % (
+            group_account_id, len(expected), engine_duration, aggregate_duration
+        ))
+
+    @staticmethod
+    def balances_per_member(member_ids, share_rows, real_rows):
+        """ Reference computation in plain Python, one accumulation per row """
+        n_consumers = defaultdict(int)
+        for transaction_id, amount, buyer_id, consumer_id in share_rows:
+            n_consumers[transaction_id] += 1
+        balances = dict.fromkeys(member_ids, 0.0)
+        bought = set()
+        for transaction_id, amount, buyer_id, consumer_id in share_rows:
+            if transaction_id not in bought:
+                bought.add(transaction_id)
+                balances[buyer_id] += amount
+            balances[consumer_id] -= amount / n_consumers[transaction_id]
+        for sender_id, receiver_id, amount in real_rows:
+            balances[sender_id] += amount
+            balances[receiver_id] -= amount
+        return balances
+
+    def check_balances(self, engine, expected):
+        for user_profile_id, balance in expected.items():
+            if abs(engine.get_balance(user_profile_id) - balance) >= 0.005:
+                raise CommandError('balance of userprofile %d differs: engine %.6f, expected %.6f' % (
+                    user_profile_id, engine.get_balance(user_profile_id), balance
+                ))
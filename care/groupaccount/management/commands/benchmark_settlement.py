@@ -0,0 +1,42 @@
+import random
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from care.groupaccount.settlement import plan_settlement, plan_settlement_pairwise
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the heap based settlement planner against naive pairwise settlement'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, nargs='+', default=[10, 100, 500, 1000],
+                            help='group sizes to plan a settlement for')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = random.Random(options['seed'])
+        for n_members in options['members']:
+            cents = [generator.randint(-100000, 100000) for i in range(n_members - 1)]
+            cents.append(-sum(cents))
+            balances = {user_profile_id: amount / 100.0 for user_profile_id, amount in enumerate(cents)}
+
+            start = time.time()
+            transfers = plan_settlement(balances)
+            heap_duration = time.time() - start
+
+            start = time.time()
+            pairwise_transfers = plan_settlement_pairwise(balances)
+            pairwise_duration = time.time() - start
+
+            remaining = defaultdict(int, {user_profile_id: amount for user_profile_id, amount in enumerate(cents)})
+            for sender_id, receiver_id, amount in transfers:
+                remaining[sender_id] += int(amount * 100)
+                remaining[receiver_id] -= int(amount * 100)
+            if any(remaining.values()):
+                raise CommandError('the settlement plan does not settle all balances')
+
+            self.stdout.write('%5d members: heap %d transfers in %.4fs, pairwise %d transfers in %.4fs' % (
+                n_members, len(transfers), heap_duration, len(pairwise_transfers), pairwise_duration
+            ))
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from care.groupaccount import groupcache
+
+
+class Command(BaseCommand):
+    help = ('Prints the hits and misses of the cached group balances and statistics, every process adds its '
+            'counts in batches of %d lookups' % groupcache.STATS_FLUSH_EVERY)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='set the counters back to zero afterwards')
+
+    def handle(self, *args, **options):
+        if settings.CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+            self.stderr.write('the cache is local to each process, these are only the counters of this command')
+        stats = groupcache.get_stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_ratio = stats['hits'] / lookups if lookups else 0.0
+        self.stdout.write('%d hits, %d misses, hit ratio %.1f%%' % (stats['hits'], stats['misses'], hit_ratio * 100))
+        if options['reset']:
+            groupcache.reset_stats()
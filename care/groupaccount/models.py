@@ -1,4 +1,9 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction as db_transaction
+from django.db.models.signals import post_save
+
+from care.groupaccount import groupcache
 
 
 class GroupSetting(models.Model):
@@ -18,17 +23,67 @@ class GroupAccount(models.Model):
 
     @staticmethod
     def add_groupaccount_info(group_account, my_user_profile):
+        GroupAccount.add_groupaccounts_info([group_account], my_user_profile)
+        return group_account
+
+    @staticmethod
+    def get_members(group_account_ids):
+        """ (user_profile_id, user_id, displayname, balance) of the members of each group account,
+        keyed on group account id and cached per group until one of its transactions changes """
+        return groupcache.get_many('members', group_account_ids, GroupAccount._compute_members)
+
+    @staticmethod
+    def _compute_members(group_account_ids):
         from care.userprofile.models import UserProfile
 
-        group_balance = 0.0
-        group_account.user_profiles = UserProfile.objects.filter(group_accounts=group_account).prefetch_related('user')
-        for user_profile in group_account.user_profiles:
-            user_profile.balance_float = UserProfile.get_balance(group_account.id, user_profile.id)
-            user_profile.balance = '%.2f' % user_profile.balance_float
-            group_balance += user_profile.balance_float
-        group_account.group_balance = '%.2f' % group_balance
-        group_account.group_balance_float = '%.3g' % group_balance
-        group_account.balance_verified = bool(abs(group_balance) < 1e-9)
-        group_account.my_balance_float = UserProfile.get_balance(group_account.id, my_user_profile.id)
-        group_account.my_balance = '%.2f' % group_account.my_balance_float
-        return group_account
+        balances = UserProfile.get_balances(group_account_ids)
+        memberships = (
+            UserProfile.group_accounts.through.objects
+            .filter(groupaccount_id__in=group_account_ids)
+            .order_by('userprofile_id')
+            .values_list('groupaccount_id', 'userprofile_id', 'userprofile__user_id', 'userprofile__displayname')
+        )
+        members = {group_account_id: [] for group_account_id in group_account_ids}
+        for group_account_id, user_profile_id, user_id, displayname in memberships:
+            balance = balances.get((group_account_id, user_profile_id), Decimal('0.00'))
+            members[group_account_id].append((user_profile_id, user_id, displayname, balance))
+        return members
+
+    @staticmethod
+    def add_groupaccounts_info(group_accounts, my_user_profile):
+        """ Adds members and balances to each group account, with a fixed number of queries for all groups """
+        from care.userprofile.models import UserProfile
+
+        members = GroupAccount.get_members([group_account.id for group_account in group_accounts])
+        for group_account in group_accounts:
+            group_balance = Decimal('0.00')
+            group_account.user_profiles = []
+            group_account.my_balance_float = 0.0
+            for user_profile_id, user_id, displayname, balance in members[group_account.id]:
+                user_profile = UserProfile(id=user_profile_id, user_id=user_id, displayname=displayname)
+                user_profile.balance_float = float(balance)
+                user_profile.balance = '%.2f' % balance
+                group_account.user_profiles.append(user_profile)
+                group_balance += balance
+                if user_profile_id == my_user_profile.id:
+                    group_account.my_balance_float = float(balance)
+            group_account.group_balance = '%.2f' % group_balance
+            group_account.group_balance_float = '%.3g' % group_balance
+            group_account.balance_verified = group_balance == 0
+            group_account.my_balance = '%.2f' % group_account.my_balance_float
+        return group_accounts
+
+
+def groupcache_group_saved(sender, instance, **kwargs):
+    """ The name and settings of a group are shown next to its cached members """
+    group_account_ids = [instance.id]
+    db_transaction.on_commit(lambda: groupcache.bump_versions(group_account_ids))
+
+
+def groupcache_settings_saved(sender, instance, **kwargs):
+    group_account_ids = list(GroupAccount.objects.filter(settings=instance).values_list('id', flat=True))
+    db_transaction.on_commit(lambda: groupcache.bump_versions(group_account_ids))
+
+
+post_save.connect(groupcache_group_saved, sender=GroupAccount)
+post_save.connect(groupcache_settings_saved, sender=GroupSetting)
@@ -0,0 +1,87 @@
+import datetime
+import logging
+
+import numpy
+
+from care.groupaccount import groupcache
+
+logger = logging.getLogger(__name__)
+
+MAX_DAYS = 366
+
+
+def _occurrence_changes(recurring_shares, consumers, start, until):
+    """ Day (counted from start), user profile id and balance change of every share the recurring
+    shares will create up to until, as three arrays. Overdue occurrences count on the first day. """
+    days = []
+    user_profile_ids = []
+    changes = []
+    for recurring in recurring_shares:
+        occurrence_days = numpy.array([(date.date() - start).days for date in recurring.due_dates(until)], dtype=numpy.int64)
+        if len(occurrence_days) == 0:
+            continue
+        # which consumer pays a leftover cent depends on the id the occurrence will get,
+        # so the projection splits the amount equally
+        consumer_ids = sorted(consumers.get(recurring.id, []))
+        share_user_profile_ids = numpy.array([recurring.buyer_id] + consumer_ids, dtype=numpy.int64)
+        share_changes = numpy.array(
+            [float(recurring.amount)] + [-float(recurring.amount) / len(consumer_ids) for consumer_id in consumer_ids]
+        )
+        days.append(numpy.tile(numpy.maximum(occurrence_days, 0), len(share_user_profile_ids)))
+        user_profile_ids.append(numpy.repeat(share_user_profile_ids, len(occurrence_days)))
+        changes.append(numpy.repeat(share_changes, len(occurrence_days)))
+    if not days:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+    return numpy.concatenate(days), numpy.concatenate(user_profile_ids), numpy.concatenate(changes)
+
+
+def compute_projection(group_account_id, start, n_days):
+    """ The balance every member of the group will have at the end of each of the n_days from start,
+    if nothing but the recurring shares of the group happens. Returns the dates and the balances
+    as lists, keyed on user profile id. """
+    from care.transaction.models import TransactionRecurring
+    from care.userprofile.models import UserProfile
+
+    until = datetime.datetime.combine(start + datetime.timedelta(days=n_days - 1), datetime.time.max)
+    recurring_shares = list(TransactionRecurring.objects.filter(group_account_id=group_account_id, next_due__lte=until))
+    consumers = {}
+    consumer_rows = TransactionRecurring.consumers.through.objects.filter(
+        transactionrecurring__in=[recurring.id for recurring in recurring_shares]
+    ).values_list('transactionrecurring_id', 'userprofile_id')
+    for recurring_id, user_profile_id in consumer_rows:
+        consumers.setdefault(recurring_id, []).append(user_profile_id)
+    days, change_user_profile_ids, changes = _occurrence_changes(recurring_shares, consumers, start, until)
+
+    balances = {
+        user_profile_id: balance
+        for (ledger_group_account_id, user_profile_id), balance in UserProfile.get_balances([group_account_id]).items()
+    }
+    member_ids = UserProfile.objects.filter(group_accounts=group_account_id).values_list('id', flat=True)
+    user_profile_ids = numpy.unique(numpy.concatenate([
+        numpy.array(list(member_ids) + list(balances), dtype=numpy.int64), change_user_profile_ids
+    ]))
+    current = numpy.array([float(balances.get(user_profile_id, 0)) for user_profile_id in user_profile_ids.tolist()])
+
+    # one row of daily changes per user profile, summed up over the days
+    rows = numpy.searchsorted(user_profile_ids, change_user_profile_ids)
+    daily_changes = numpy.bincount(
+        rows * n_days + days, weights=changes, minlength=len(user_profile_ids) * n_days
+    ).reshape(len(user_profile_ids), n_days)
+    timeline = current[:, numpy.newaxis] + numpy.cumsum(daily_changes, axis=1)
+    logger.info('projected ' + str(len(recurring_shares)) + ' recurring shares of group ' + str(group_account_id)
+                + ' over ' + str(n_days) + ' days')
+    return {
+        'dates': [start + datetime.timedelta(days=day) for day in range(n_days)],
+        'balances': {
+            user_profile_id: timeline[index].round(2).tolist()
+            for index, user_profile_id in enumerate(user_profile_ids.tolist())
+        },
+    }
+
+
+def get_projection(group_account_id, n_days):
+    """ compute_projection from today, cached until the group or one of its recurring shares changes """
+    n_days = max(1, min(n_days, MAX_DAYS))
+    today = datetime.date.today()
+    kind = 'projection:%s:%d' % (today.isoformat(), n_days)
+    return groupcache.get(kind, group_account_id, lambda: compute_projection(group_account_id, today, n_days))
@@ -0,0 +1,117 @@
+import datetime
+import hashlib
+import heapq
+import logging
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _to_cents(balances):
+    return {user_profile_id: int(round(balance * 100)) for user_profile_id, balance in balances.items()}
+
+
+def plan_settlement(balances):
+    """ Proposes the transfers that bring every balance to zero, as a list of
+    (sender id, receiver id, amount) tuples, given balances keyed on user profile id.
+
+    Repeatedly matches the largest debtor with the largest creditor using two heaps,
+    so at most one transfer less than the number of members with a balance is
+    needed and planning takes O(n log n). Rounding leftovers below a cent are dropped.
+    """
+    debtors = []
+    creditors = []
+    for user_profile_id, cents in _to_cents(balances).items():
+        if cents < 0:
+            debtors.append((cents, user_profile_id))
+        elif cents > 0:
+            creditors.append((-cents, user_profile_id))
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        debt, debtor_id = heapq.heappop(debtors)
+        credit, creditor_id = heapq.heappop(creditors)
+        cents = min(-debt, -credit)
+        transfers.append((debtor_id, creditor_id, Decimal(cents) / 100))
+        if -debt > cents:
+            heapq.heappush(debtors, (debt + cents, debtor_id))
+        if -credit > cents:
+            heapq.heappush(creditors, (credit + cents, creditor_id))
+    return transfers
+
+
+def plan_settlement_pairwise(balances):
+    """ Naive settlement where every debtor pays every creditor its part of the debt,
+    needing a transfer for each debtor-creditor pair. Used as reference in benchmarks. """
+    cents = _to_cents(balances)
+    debtors = [(user_profile_id, -amount) for user_profile_id, amount in cents.items() if amount < 0]
+    creditors = [(user_profile_id, amount) for user_profile_id, amount in cents.items() if amount > 0]
+    total_credit = sum(amount for user_profile_id, amount in creditors)
+    transfers = []
+    for debtor_id, debt in debtors:
+        for creditor_id, credit in creditors:
+            amount = debt * credit // total_credit
+            if amount > 0:
+                transfers.append((debtor_id, creditor_id, Decimal(amount) / 100))
+    return transfers
+
+
+def _max_amount(model):
+    """ Largest amount the amount field of model can store """
+    field = model._meta.get_field('amount')
+    return Decimal(10 ** (field.max_digits - field.decimal_places)) - Decimal(1) / 10 ** field.decimal_places
+
+
+def split_transfer(amount, max_amount):
+    """ The amount as parts of at most max_amount """
+    parts = []
+    while amount > max_amount:
+        parts.append(max_amount)
+        amount -= max_amount
+    parts.append(amount)
+    return parts
+
+
+def plan_digest(transfers):
+    """ Digest of planned transfers. The settle form posts back the digest of the transfers it showed,
+    so no other transfers are registered when the balances changed in between. """
+    return hashlib.sha1(repr(list(transfers)).encode()).hexdigest()
+
+
+def count_settlement_transactions(transfers):
+    """ Number of real transactions create_settlement_transactions makes for the transfers """
+    from care.transaction.models import TransactionReal
+
+    max_amount = _max_amount(TransactionReal)
+    return sum(len(split_transfer(amount, max_amount)) for sender_id, receiver_id, amount in transfers)
+
+
+def create_settlement_transactions(group_account, transfers, user_profile):
+    """ Creates a real transaction for every planned transfer, all in one database transaction.
+    A transfer larger than a real transaction can hold is split over several, each one is validated
+    before it is saved. """
+    from care.transaction.models import Modification, TransactionReal
+
+    max_amount = _max_amount(TransactionReal)
+    created = []
+    with db_transaction.atomic():
+        for sender_id, receiver_id, amount in transfers:
+            for part in split_transfer(amount, max_amount):
+                transaction_real = TransactionReal(
+                    amount=part,
+                    sender_id=sender_id,
+                    receiver_id=receiver_id,
+                    comment='Settle up',
+                    group_account=group_account,
+                    date=datetime.datetime.now(),
+                )
+                transaction_real.full_clean()
+                transaction_real.save()
+                Modification.objects.create(user=user_profile, transaction_real=transaction_real)
+                created.append(transaction_real)
+    logger.info('created ' + str(len(created)) + ' settlement transactions in group ' + str(group_account.id))
+    return created
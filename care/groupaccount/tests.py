@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from care.groupaccount.models import GroupAccount
+from care.transaction.models import Transaction, TransactionReal
+from care.userprofile.models import NotificationInterval, UserProfile
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SettleGroupAccountTest(TestCase):
+    """ The settle page registers the transfers it showed, by default only the ones of the user """
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.group_account = GroupAccount.objects.create(name='flatmates')
+        cls.user_profiles = []
+        for i in range(3):
+            user = User.objects.create_user('user' + str(i), 'user' + str(i) + '@example.com', 'password')
+            user_profile = UserProfile.objects.get(user=user)
+            user_profile.group_accounts.add(cls.group_account)
+            cls.user_profiles.append(user_profile)
+        cls.path = '/group/settle/' + str(cls.group_account.id)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user_profiles[0].user)
+
+    def buy(self, amount, buyer, consumers):
+        transaction = Transaction.objects.create(
+            amount=amount, what='groceries', buyer=buyer, group_account=self.group_account
+        )
+        transaction.consumers.set(consumers)
+
+    def get_plan(self):
+        return self.client.get(self.path).context['plan']
+
+    def test_registers_the_transfers_of_the_user(self):
+        # user1 gets 10.00 from user0 and 10.00 from user2
+        self.buy(Decimal('30.00'), self.user_profiles[1], self.user_profiles)
+        response = self.client.get(self.path)
+        self.assertContains(response, 'Register my 1 transaction<')
+        self.assertContains(response, 'Register all 2 transactions')
+
+        self.client.post(self.path, {'plan': response.context['plan'], 'register': 'own'})
+        self.assertEqual(
+            list(TransactionReal.objects.values_list('sender_id', 'receiver_id', 'amount')),
+            [(self.user_profiles[0].id, self.user_profiles[1].id, Decimal('10.00'))]
+        )
+
+    def test_registers_all_transfers_when_asked(self):
+        self.buy(Decimal('30.00'), self.user_profiles[1], self.user_profiles)
+        self.client.post(self.path, {'plan': self.get_plan(), 'register': 'all'})
+        self.assertEqual(TransactionReal.objects.count(), 2)
+
+    def test_changed_balances_are_not_registered(self):
+        self.buy(Decimal('30.00'), self.user_profiles[1], self.user_profiles)
+        plan = self.get_plan()
+        self.buy(Decimal('6.00'), self.user_profiles[2], self.user_profiles)
+        # the cached balances are bumped on commit, which a test case never does
+        cache.clear()
+        response = self.client.post(self.path, {'plan': plan, 'register': 'all'})
+        self.assertContains(response, 'The balances changed')
+        self.assertNotEqual(response.context['plan'], plan)
+        self.assertFalse(TransactionReal.objects.exists())
+
+    def test_count_includes_split_transfers(self):
+        # user0 owes 12000.00, more than a real transaction holds
+        for i in range(3):
+            self.buy(Decimal('8000.00'), self.user_profiles[1], self.user_profiles[:2])
+        response = self.client.get(self.path)
+        self.assertContains(response, 'Register my 2 transactions')
+        self.client.post(self.path, {'plan': response.context['plan'], 'register': 'own'})
+        self.assertEqual(
+            sorted(TransactionReal.objects.values_list('amount', flat=True)), [Decimal('2000.01'), Decimal('9999.99')]
+        )
@@ -1,19 +1,22 @@
+import datetime
 import logging
 
-from django.db.models import Sum
 from django.shortcuts import HttpResponseRedirect
 from django.views.generic.edit import FormView
 
-from care.base.views import BaseView
+from care.base.views import BaseView, ConditionalView
+from care.groupaccount import groupcache
+from care.groupaccount.balanceengine import GroupBalanceEngine
 from care.groupaccount.forms import NewGroupAccountForm, EditGroupSettingForm
 from care.groupaccount.models import GroupAccount, GroupSetting
-from care.transaction.models import Transaction
+from care.groupaccount.projection import get_projection
+from care.groupaccount.settlement import plan_settlement, plan_digest, count_settlement_transactions, create_settlement_transactions
 from care.userprofile.models import UserProfile
 
 logger = logging.getLogger(__name__)
 
 
-class MyGroupAccountsView(BaseView):
+class MyGroupAccountsView(ConditionalView):
     template_name = "groupaccount/myaccounts.html"
     context_object_name = "my groups"
 
@@ -21,12 +24,10 @@ class MyGroupAccountsView(BaseView):
         return 'group'
 
     def get_context_data(self, **kwargs):
-        user = self.request.user
-        user_profile = UserProfile.objects.get(user=user)
+        user_profile = self.request.userprofile
         user_profile.get_show_table(self.kwargs['tableView'])
-        group_accounts = user_profile.group_accounts.all()
-        for group_account in group_accounts:
-            GroupAccount.add_groupaccount_info(group_account, user_profile)
+        group_accounts = list(user_profile.group_accounts.select_related('settings__notification_lower_limit_interval'))
+        GroupAccount.add_groupaccounts_info(group_accounts, user_profile)
         context = super().get_context_data(**kwargs)
         context['groups'] = group_accounts
         context['groupssection'] = True
@@ -56,7 +57,7 @@ class NewGroupAccountView(FormView, BaseView):
         group_account.settings = settings
         group_account.save()
         
-        user_profile = UserProfile.objects.get(user=self.request.user)
+        user_profile = self.request.userprofile
         user_profile.group_accounts.add(group_account)
         user_profile.save()
 
@@ -80,7 +81,7 @@ class EditGroupSettingView(BaseView, FormView):
         return EditGroupSettingForm(self.request.user, instance=group_settings, **self.get_form_kwargs())
 
     def form_valid(self, form):
-        userprofile = UserProfile.objects.get(user=self.request.user)
+        userprofile = self.request.userprofile
         super().form_valid(form)
         form.save()
         show_tablestr = "1"
@@ -116,23 +117,23 @@ class StatisticsGroupAccount(BaseView):
         group_account_id = kwargs['groupaccount_id']
         group = GroupAccount.objects.get(id=group_account_id)
         group_users = UserProfile.objects.filter(group_accounts=group.id)
-        if UserProfile.objects.get(user=self.request.user) not in group_users:
+        if self.request.userprofile not in group_users:
             return context
 
+        statistics = groupcache.get('statistics', group.id, lambda: self.compute_statistics(group.id))
         for user in group_users:
-            user.balance = UserProfile.get_balance(group.id, user.id)
-            user.n_trans_buyer = Transaction.objects.filter(buyer=user, group_account=group).count()
-            user.n_trans_consumer = Transaction.objects.filter(consumers=user, group_account=group).count()
-            amount__sum = Transaction.get_buyer_transactions(user.id).filter(group_account=group).aggregate(Sum('amount'))['amount__sum']
-            if amount__sum:
-                user.total_bought = float(amount__sum)
-            else:
-                user.total_bought = 0.0
-            consumer_transactions = Transaction.get_consumer_transactions(user.id).filter(group_account=group)
-            total_consumed = 0.0
-            for transaction in consumer_transactions:
-                total_consumed += transaction.amount_per_person
-            user.total_consumed = total_consumed
+            user.balance, user.n_trans_buyer, user.n_trans_consumer, user.total_bought, user.total_consumed = \
+                statistics['users'].get(user.id, (0.0, 0, 0, 0.0, 0.0))
+
+        displaynames = {user.id: user.displayname for user in group_users}
+        debts = []
+        for debtor_id, creditor_id, amount in statistics['debts']:
+            if debtor_id in displaynames and creditor_id in displaynames:
+                debts.append({
+                    'debtor': displaynames[debtor_id],
+                    'creditor': displaynames[creditor_id],
+                    'amount': amount,
+                })
 
         total_consumed = 0.0
         total_bought = 0.0
@@ -152,4 +153,125 @@ class StatisticsGroupAccount(BaseView):
         context['total_balance'] = total_balance
         context['total_shares'] = total_shares
         context['total_shared_with'] = total_shared_with
-        return context
\ No newline at end of file
+        context['debts'] = debts
+        return context
+
+    @staticmethod
+    def compute_statistics(group_account_id):
+        """ Plain numbers of the balance engine, so they can be cached """
+        engine = GroupBalanceEngine.for_group_account(group_account_id)
+        users = {}
+        for index, user_profile_id in enumerate(engine.user_profile_ids.tolist()):
+            users[user_profile_id] = (
+                float(engine.balances[index]),
+                int(engine.n_trans_buyer[index]),
+                int(engine.n_trans_consumer[index]),
+                float(engine.total_bought[index]),
+                float(engine.total_consumed[index]),
+            )
+        return {'users': users, 'debts': engine.get_debts()}
+
+
+class ProjectionGroupAccountView(BaseView):
+    template_name = "groupaccount/projection.html"
+    horizons = (31, 92, 366)
+
+    def get_active_menu(self):
+        return 'group'
+
+    def get_days(self):
+        try:
+            days = int(self.request.GET.get('days', self.horizons[0]))
+        except ValueError:
+            days = self.horizons[0]
+        return days if days in self.horizons else self.horizons[0]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        group = GroupAccount.objects.get(id=self.kwargs['groupaccount_id'])
+        group_users = list(UserProfile.objects.filter(group_accounts=group.id))
+        if self.get_userprofile().id not in [user.id for user in group_users]:
+            return context
+
+        days = self.get_days()
+        projection = get_projection(group.id, days)
+        dates = projection['dates']
+        # a column for the end of every month and for the end of the horizon
+        columns = [
+            day for day, date in enumerate(dates)
+            if (date + datetime.timedelta(days=1)).day == 1 or day == len(dates) - 1
+        ]
+        current_balances = GroupAccount.get_members([group.id])[group.id]
+        current_balances = {user_profile_id: balance for user_profile_id, user_id, displayname, balance in current_balances}
+        for user in group_users:
+            balances = projection['balances'].get(user.id, [0.0] * len(dates))
+            user.balance = current_balances.get(user.id, 0.0)
+            user.projected_balances = [balances[day] for day in columns]
+        context['group'] = group
+        context['users'] = group_users
+        context['dates'] = [dates[day] for day in columns]
+        context['days'] = days
+        context['horizons'] = self.horizons
+        return context
+
+
+class SettleGroupAccountView(BaseView):
+    template_name = "groupaccount/settle.html"
+
+    def get_active_menu(self):
+        return 'group'
+
+    def get_group_account(self):
+        group = GroupAccount.objects.get(id=self.kwargs['groupaccount_id'])
+        GroupAccount.add_groupaccount_info(group, self.get_userprofile())
+        return group
+
+    def get_transfers(self, group):
+        balances = {user_profile.id: user_profile.balance_float for user_profile in group.user_profiles}
+        return plan_settlement(balances)
+
+    def get_own_transfers(self, transfers):
+        """ The transfers the current user sends or receives """
+        user_profile_id = self.get_userprofile().id
+        return [transfer for transfer in transfers if user_profile_id in transfer[:2]]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        group = self.get_group_account()
+        members = {user_profile.id: user_profile for user_profile in group.user_profiles}
+        if self.get_userprofile().id not in members:
+            return context
+
+        planned = self.get_transfers(group)
+        own = self.get_own_transfers(planned)
+        transfers = []
+        for sender_id, receiver_id, amount in planned:
+            transfers.append({
+                'sender': members[sender_id],
+                'receiver': members[receiver_id],
+                'amount': amount,
+            })
+        context['group'] = group
+        context['transfers'] = transfers
+        context['plan'] = plan_digest(planned)
+        # a transfer above what a real transaction holds is registered as several
+        context['nOwnTransactions'] = count_settlement_transactions(own)
+        context['nAllTransactions'] = count_settlement_transactions(planned)
+        return context
+
+    def post(self, request, *args, **kwargs):
+        group = self.get_group_account()
+        user_profile = self.get_userprofile()
+        if user_profile.id not in [member.id for member in group.user_profiles]:
+            return HttpResponseRedirect('/transactions/real/0')
+
+        transfers = self.get_transfers(group)
+        if request.POST.get('plan') != plan_digest(transfers):
+            context = self.get_context_data(**kwargs)
+            context['error'] = 'The balances changed since the transfers were shown. These are the transfers that settle the new balances.'
+            return self.render_to_response(context)
+        # the transfers between the other members are only registered when asked for explicitly
+        if request.POST.get('register') != 'all':
+            transfers = self.get_own_transfers(transfers)
+        create_settlement_transactions(group, transfers, user_profile)
+        return HttpResponseRedirect('/transactions/real/0')
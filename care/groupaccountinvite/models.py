@@ -2,13 +2,20 @@ import logging
 from datetime import datetime
 from itertools import chain
 
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction as db_transaction
+from django.db.models.signals import post_save, pre_save, post_delete
 
 from care.userprofile.models import UserProfile
 from care.groupaccount.models import GroupAccount
 
 logger = logging.getLogger(__name__)
 
+OPEN_INVITES_KEY = 'userprofile:%d:open_invites'
+# the count is dropped on every change, the timeout bounds how long it can be wrong when that is missed,
+# for example after a bulk update that sends no signals
+OPEN_INVITES_TIMEOUT = 10 * 60
+
 
 class GroupAccountInvite(models.Model):
     group_account = models.ForeignKey(GroupAccount, on_delete=models.CASCADE)
@@ -34,5 +41,42 @@ class GroupAccountInvite(models.Model):
         invites_all = set(invites_all)
         return sorted(invites_all, key=lambda instance: instance.createdDateAndTime, reverse=True)
 
+    @staticmethod
+    def get_open_invites_count(userprofile_id):
+        """ Number of invites the user has not accepted or declined yet, cached in the shared cache
+        until one of them changes or OPEN_INVITES_TIMEOUT passes """
+        key = OPEN_INVITES_KEY % userprofile_id
+        count = cache.get(key)
+        if count is None:
+            count = GroupAccountInvite.objects.filter(invitee_id=userprofile_id, isAccepted=False, isDeclined=False).count()
+            cache.set(key, count, OPEN_INVITES_TIMEOUT)
+        return count
+
     def __str__(self):
         return self.group_account.name
+
+
+def _forget_open_invites_count(userprofile_ids):
+    keys = [OPEN_INVITES_KEY % userprofile_id for userprofile_id in set(userprofile_ids)]
+    db_transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def open_invites_pre_save(sender, instance, **kwargs):
+    # the count of a previous invitee becomes stale too when the invitee is changed
+    instance._open_invites_invitee_id = None
+    if instance.pk is not None:
+        instance._open_invites_invitee_id = GroupAccountInvite.objects.filter(
+            pk=instance.pk
+        ).values_list('invitee_id', flat=True).first()
+
+
+def open_invites_post_change(sender, instance, **kwargs):
+    userprofile_ids = [instance.invitee_id]
+    if getattr(instance, '_open_invites_invitee_id', None) is not None:
+        userprofile_ids.append(instance._open_invites_invitee_id)
+    _forget_open_invites_count(userprofile_ids)
+
+
+pre_save.connect(open_invites_pre_save, sender=GroupAccountInvite)
+post_save.connect(open_invites_post_change, sender=GroupAccountInvite)
+post_delete.connect(open_invites_post_change, sender=GroupAccountInvite)
@@ -56,7 +56,7 @@ class DeclineInviteView(MyGroupAccountInvitesView):
     def get_context_data(self, **kwargs):
         invite = GroupAccountInvite.objects.get(id=self.kwargs['inviteId'])
         user = self.request.user
-        user_profile = UserProfile.objects.get(user=user)
+        user_profile = self.request.userprofile
 
         # make sure the decliner is the invitee
         if invite.invitee.user == user:
@@ -68,7 +68,6 @@ class DeclineInviteView(MyGroupAccountInvitesView):
                 logger.debug( 'Group is declined.' )
                 invite.isDeclined = True
                 group_account = GroupAccount.objects.get(id=invite.group_account.id)
-                user_profile = UserProfile.objects.get(user=user)
                 user_profile.group_accounts.remove(group_account)
                 user_profile.save()
             invite.save()
@@ -88,7 +87,7 @@ class NewInviteView(FormView, BaseView):
 
     def get_form(self, form_class=NewInviteForm):
         user_profile_to_invite = UserProfile.objects.get(id=self.kwargs['userProfileId'])
-        form = NewInviteForm(self.request.user, user_profile_to_invite, **self.get_form_kwargs())
+        form = NewInviteForm(self.request.userprofile, user_profile_to_invite, **self.get_form_kwargs())
         return form
 
     def form_valid(self, form):
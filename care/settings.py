@@ -33,6 +33,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'care.userprofile.middleware.UserProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -108,9 +109,26 @@ CRON_CLASSES = [
     'care.base.cronjobs.WeeklyEmails',
     'care.base.cronjobs.MonthlyEmails',
     'care.base.cronjobs.CreateRecurrentShareOccurrence',
+    'care.base.cronjobs.SendOutgoingEmails',
     # 'care.base.cronjobs.TestEmails',
 ]
 
+#########
+# CACHE #
+#########
+
+# shared by the web workers and the cron jobs, a group cache version bumped in one
+# process must be seen by all of them (see care/groupaccount/groupcache.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 ##################
 # LOCAL SETTINGS #
 ##################
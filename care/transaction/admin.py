@@ -1,8 +1,20 @@
 from django.contrib import admin
 
 from care.transaction.models import Transaction
+from care.transaction.models import TransactionConsumer
 from care.transaction.models import TransactionReal
 from care.transaction.models import Modification
+from care.transaction.models import GroupBalance
+
+
+class TransactionConsumerInline(admin.TabularInline):
+    """ Only the weights can be edited here, consumers are added and removed in the app """
+    model = TransactionConsumer
+    fields = ('userprofile', 'weight', 'amount')
+    readonly_fields = ('userprofile', 'amount')
+    extra = 0
+    max_num = 0
+    can_delete = False
 
 
 class TransactionAdmin(admin.ModelAdmin):
@@ -11,13 +23,17 @@ class TransactionAdmin(admin.ModelAdmin):
         (None, {'fields': ['date']}),
         (None, {'fields': ['amount']}),
         (None, {'fields': ['group_account']}),
-        (None, {'fields': ['buyer']}),
-        (None, {'fields': ['consumers']}), ]
+        (None, {'fields': ['buyer']}), ]
+    inlines = [TransactionConsumerInline]
     list_display = ('what', 'amount', 'group_account', 'buyer', 'date')
     list_filter = ['date']
     search_fields = ['what']
     date_hierarchy = 'date'
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.update_consumer_amounts()
+
 admin.site.register(Transaction, TransactionAdmin)
 
 
@@ -43,3 +59,10 @@ class ModificationAdmin(admin.ModelAdmin):
     list_display = ('date', 'user')
 
 admin.site.register(Modification, ModificationAdmin)
+
+
+class GroupBalanceAdmin(admin.ModelAdmin):
+    list_display = ('group_account', 'user_profile', 'balance')
+    list_filter = ['group_account']
+
+admin.site.register(GroupBalance, GroupBalanceAdmin)
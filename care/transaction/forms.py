@@ -33,7 +33,7 @@ class TransactionForm(forms.ModelForm):
 
 
 class NewTransactionForm(TransactionForm):
-    def __init__(self, group_account_id, user, *args, **kwargs):
+    def __init__(self, group_account_id, user_profile, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.fields['consumers'] = forms.ModelMultipleChoiceField(
@@ -47,10 +47,10 @@ class NewTransactionForm(TransactionForm):
             queryset=UserProfile.objects.filter(group_accounts=group_account_id),
             empty_label=None
         )
-        self.fields['buyer'].initial = UserProfile.objects.get(user=user)
+        self.fields['buyer'].initial = user_profile
 
         self.fields['group_account'] = forms.ModelChoiceField(
-            queryset=UserProfile.objects.get(user=user).group_accounts,
+            queryset=user_profile.group_accounts,
             widget=forms.Select(attrs={"onChange":'form.submit()'}),
             empty_label=None,
             label='Group'
@@ -124,18 +124,18 @@ class EditRecurringTransactionForm(EditTransactionForm):
 
 
 class NewRealTransactionForm(forms.ModelForm):
-    def __init__(self, group_account_id, user, *args, **kwargs):
+    def __init__(self, group_account_id, user_profile, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         #  self.fields['sender'] = forms.ModelChoiceField(queryset=UserProfile.objects.get(user=user),
         #  widget = forms.HiddenInput, empty_label=None, label='From')
         self.fields['sender'] = forms.ModelChoiceField(
-            queryset=UserProfile.objects.filter(user=user),
+            queryset=UserProfile.objects.filter(id=user_profile.id),
             empty_label=None,
             label='From',
             widget=forms.HiddenInput()
         )
-        self.fields['sender'].initial = UserProfile.objects.get(user=user)
+        self.fields['sender'].initial = user_profile
         self.fields['receiver'] = forms.ModelChoiceField(
             queryset=UserProfile.objects.filter(group_accounts=group_account_id),
             empty_label=None,
@@ -146,7 +146,7 @@ class NewRealTransactionForm(forms.ModelForm):
         self.fields['amount'].label = '€'
 
         self.fields['group_account'] = forms.ModelChoiceField(
-            queryset=UserProfile.objects.get(user=user).group_accounts,
+            queryset=user_profile.group_accounts,
             widget=forms.Select(attrs={"onChange": 'form.submit()'}),
             empty_label=None,
             label='Group'
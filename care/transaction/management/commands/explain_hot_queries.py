@@ -0,0 +1,218 @@
+import datetime
+import random
+import time
+
+import recurrence
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction as db_transaction
+from django.db.models import Count, Sum
+
+from care.groupaccount.models import GroupAccount
+from care.transaction.models import Transaction, TransactionConsumer, TransactionReal, TransactionRecurring
+from care.userprofile.models import UserProfile
+
+# created by RunSQL in migration 0007, the recurring consumers through table has no model Meta
+THROUGH_INDEX_NAMES = ['recurring_consumer_share_idx']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Prints the SQLite query plan and timings of the hot transaction lookups, with and without their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', type=int, default=0,
+                            help='first add this many synthetic shares (and a tenth as many real transactions), '
+                                 'all rolled back afterwards')
+        parser.add_argument('--user-profile', type=int,
+                            help='user profile to query for, defaults to the most active buyer')
+        parser.add_argument('--group-account', type=int,
+                            help='group account to query for, defaults to a group of the user profile')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='number of runs of each query, the fastest is reported')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--analyze', action='store_true',
+                            help='run ANALYZE after populating, so the plans use fresh statistics. ANALYZE takes '
+                                 'a write lock on the whole SQLite database while it runs, and the statistics '
+                                 'it writes are rolled back with the synthetic rows')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is only available on SQLite, not on ' + connection.vendor)
+        self.stdout.write('querying the database ' + str(connection.settings_dict['NAME'])
+                          + ', everything this command writes is rolled back')
+        try:
+            with db_transaction.atomic():
+                if options['populate']:
+                    self.populate(options['populate'], random.Random(options['seed']))
+                if options['analyze']:
+                    self.stdout.write('running ANALYZE, the database is locked for writes until it is done')
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                self.explain_all(options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def explain_all(self, options):
+        user_profile_id = options['user_profile'] or self.most_active_buyer()
+        if user_profile_id is None:
+            raise CommandError('there are no shares to query, use --populate')
+        group_account_id = options['group_account'] or UserProfile.objects.get(
+            id=user_profile_id
+        ).group_accounts.values_list('id', flat=True).first()
+        self.stdout.write('user profile %d, group account %s, %d shares, %d real transactions' % (
+            user_profile_id, group_account_id, Transaction.objects.count(), TransactionReal.objects.count()
+        ))
+
+        queries = self.hot_queries(user_profile_id, group_account_id)
+        with_indexes = {}
+        for name, sql, params in queries:
+            self.stdout.write('\n' + name)
+            for row in self.query_plan(sql, params):
+                self.stdout.write('    ' + row)
+            with_indexes[name] = self.time_query(sql, params, options['repeat'])
+
+        # DDL is transactional in SQLite, the savepoint brings the indexes back
+        without_indexes = {}
+        try:
+            with db_transaction.atomic():
+                with connection.cursor() as cursor:
+                    for index_name in self.index_names():
+                        cursor.execute('DROP INDEX IF EXISTS "%s"' % index_name)
+                for name, sql, params in queries:
+                    without_indexes[name] = self.time_query(sql, params, options['repeat'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write('\n%-28s %12s %12s' % ('query', 'no indexes', 'indexes'))
+        for name, sql, params in queries:
+            self.stdout.write('%-28s %10.2fms %10.2fms' % (
+                name, without_indexes[name] * 1000, with_indexes[name] * 1000
+            ))
+
+    @staticmethod
+    def hot_queries(user_profile_id, group_account_id):
+        """ (name, sql, params) of the history and balance lookups, without their prefetches. The histories
+        are the first page of each of their KeysetSources. """
+        shares_bought, shares_consumed = Transaction.get_history_sources(user_profile_id)
+        recurring_bought, recurring_consumed = TransactionRecurring.get_history_sources(user_profile_id)
+        real_sent, real_received = TransactionReal.get_history_sources(user_profile_id)
+        querysets = [
+            ('shares bought', shares_bought.walk(newer=False)[:26]),
+            ('shares consumed', shares_consumed.walk(newer=False)[:26]),
+            ('recurring bought', recurring_bought.walk(newer=False)[:26]),
+            ('recurring consumed', recurring_consumed.walk(newer=False)[:26]),
+            ('real sent', real_sent.walk(newer=False)[:26]),
+            ('real received', real_received.walk(newer=False)[:26]),
+            ('bought in group', Transaction.objects.filter(
+                group_account_id=group_account_id, buyer_id=user_profile_id
+            ).values_list('buyer_id').annotate(Sum('amount')).order_by()),
+            ('consumed in group', TransactionConsumer.objects.filter(
+                userprofile_id=user_profile_id, transaction__group_account_id=group_account_id
+            ).values_list('userprofile_id').annotate(Sum('amount')).order_by()),
+            ('sent in group', TransactionReal.objects.filter(
+                group_account_id=group_account_id, sender_id=user_profile_id
+            ).values_list('sender_id').annotate(Sum('amount')).order_by()),
+            ('received in group', TransactionReal.objects.filter(
+                group_account_id=group_account_id, receiver_id=user_profile_id
+            ).values_list('receiver_id').annotate(Sum('amount')).order_by()),
+        ]
+        return [(name,) + queryset.query.sql_with_params() for name, queryset in querysets]
+
+    @staticmethod
+    def index_names():
+        models = (Transaction, TransactionConsumer, TransactionReal, TransactionRecurring)
+        return [index.name for model in models for index in model._meta.indexes] + THROUGH_INDEX_NAMES
+
+    @staticmethod
+    def query_plan(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    @staticmethod
+    def time_query(sql, params, repeat):
+        durations = []
+        with connection.cursor() as cursor:
+            for _ in range(repeat):
+                start = time.time()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                durations.append(time.time() - start)
+        return min(durations)
+
+    @staticmethod
+    def most_active_buyer():
+        return Transaction.objects.values_list('buyer_id').annotate(
+            n=Count('id')
+        ).order_by('-n').values_list('buyer_id', flat=True).first()
+
+    def populate(self, n_shares, rand, n_users=1000, n_groups=100):
+        """ Adds users, groups and shares with bulk inserts, bypassing the ledger signals """
+        self.stdout.write('adding %d synthetic shares...' % n_shares)
+        prefix = 'explain%d_' % rand.randint(0, 10**6)
+        User.objects.bulk_create([User(username=prefix + str(i)) for i in range(n_users)])
+        user_ids = User.objects.filter(username__startswith=prefix).values_list('id', flat=True)
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id, displayname='explain') for user_id in user_ids])
+        user_profile_ids = list(UserProfile.objects.filter(user_id__in=user_ids).values_list('id', flat=True))
+        GroupAccount.objects.bulk_create([GroupAccount(name=prefix + str(i)) for i in range(n_groups)])
+        group_account_ids = list(GroupAccount.objects.filter(name__startswith=prefix).values_list('id', flat=True))
+
+        members = {group_account_id: [] for group_account_id in group_account_ids}
+        for i, user_profile_id in enumerate(user_profile_ids):
+            members[group_account_ids[i % n_groups]].append(user_profile_id)
+        UserProfile.group_accounts.through.objects.bulk_create([
+            UserProfile.group_accounts.through(userprofile_id=user_profile_id, groupaccount_id=group_account_id)
+            for group_account_id, user_profile_ids in members.items() for user_profile_id in user_profile_ids
+        ])
+
+        now = datetime.datetime.now()
+
+        def random_share(model, share_id):
+            group_account_id = rand.choice(group_account_ids)
+            consumers = rand.sample(members[group_account_id], rand.randint(1, 4))
+            when = now - datetime.timedelta(minutes=rand.randint(0, 3 * 365 * 24 * 60))
+            share = model(id=share_id, amount=rand.randint(1, 10000) / 100, what='explain',
+                          buyer_id=rand.choice(members[group_account_id]), group_account_id=group_account_id,
+                          date=when, last_modified=when)
+            return share, consumers
+
+        self.populate_shares(Transaction, n_shares, random_share)
+        self.populate_shares(TransactionRecurring, n_shares // 100, random_share)
+
+        first_id = (TransactionReal.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        batch = []
+        for real_id in range(first_id, first_id + n_shares // 10):
+            group_account_id = rand.choice(group_account_ids)
+            sender_id, receiver_id = rand.sample(members[group_account_id], 2)
+            when = now - datetime.timedelta(minutes=rand.randint(0, 3 * 365 * 24 * 60))
+            batch.append(TransactionReal(id=real_id, amount=rand.randint(1, 10000) / 100, sender_id=sender_id,
+                                         receiver_id=receiver_id, comment='explain',
+                                         group_account_id=group_account_id, date=when, last_modified=when))
+        TransactionReal.objects.bulk_create(batch)
+
+    @staticmethod
+    def populate_shares(model, n_shares, random_share, batch_size=10000):
+        through = model.consumers.through
+        share_field = model.consumers.field.m2m_field_name() + '_id'
+        first_id = (model.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        for batch_start in range(first_id, first_id + n_shares, batch_size):
+            shares = []
+            consumer_rows = []
+            for share_id in range(batch_start, min(batch_start + batch_size, first_id + n_shares)):
+                share, consumers = random_share(model, share_id)
+                if model is TransactionRecurring:
+                    share.every = recurrence.deserialize('RRULE:FREQ=WEEKLY')
+                shares.append(share)
+                fields = {share_field: share_id}
+                if model is Transaction:
+                    fields['last_modified'] = share.last_modified
+                consumer_rows += [through(userprofile_id=consumer_id, **fields) for consumer_id in consumers]
+            model.objects.bulk_create(shares)
+            through.objects.bulk_create(consumer_rows)
@@ -0,0 +1,57 @@
+import logging
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from care.groupaccount.models import GroupAccount
+from care.transaction.models import GroupBalance
+from care.userprofile.models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the GroupBalance ledger from all shares and transactions and verifies it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true',
+                            help='only compare the ledger with the computed balances, do not rebuild')
+        parser.add_argument('--tolerance', type=Decimal, default=Decimal('0.00'),
+                            help='maximum allowed difference between ledger and computed balance')
+
+    def handle(self, *args, **options):
+        balances = self.compute_balances()
+        if not options['verify_only']:
+            with db_transaction.atomic():
+                GroupBalance.objects.all().delete()
+                GroupBalance.objects.bulk_create([
+                    GroupBalance(group_account_id=group_account_id, user_profile_id=user_profile_id, balance=balance)
+                    for (group_account_id, user_profile_id), balance in balances.items()
+                ])
+            self.stdout.write('rebuilt %d ledger rows' % len(balances))
+
+        ledger = {
+            (group_account_id, user_profile_id): balance
+            for group_account_id, user_profile_id, balance
+            in GroupBalance.objects.values_list('group_account_id', 'user_profile_id', 'balance')
+        }
+        mismatches = 0
+        for key in sorted(set(balances) | set(ledger)):
+            expected = balances.get(key, Decimal('0.00'))
+            actual = ledger.get(key, Decimal('0.00'))
+            if abs(expected - actual) > options['tolerance']:
+                mismatches += 1
+                self.stdout.write('group %d, userprofile %d: ledger %.2f, computed %.2f' % (key + (actual, expected)))
+        if mismatches:
+            raise CommandError('%d ledger rows do not match the computed balances' % mismatches)
+        self.stdout.write('verified %d ledger rows' % len(balances))
+
+    @staticmethod
+    def compute_balances():
+        """ Computes the balance of every group member and transaction participant with the aggregate path """
+        balances = UserProfile.compute_balances(GroupAccount.objects.values_list('id', flat=True))
+        memberships = UserProfile.group_accounts.through.objects.values_list('groupaccount_id', 'userprofile_id')
+        for key in memberships:
+            balances[key] += 0
+        return balances
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:18
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_group_balances(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Transaction = apps.get_model("transaction", "Transaction")
+    TransactionReal = apps.get_model("transaction", "TransactionReal")
+    GroupBalance = apps.get_model("transaction", "GroupBalance")
+    UserProfile = apps.get_model("userprofile", "UserProfile")
+
+    balances = defaultdict(float)
+    memberships = UserProfile.group_accounts.through.objects.using(db_alias)
+    for user_profile_id, group_account_id in memberships.values_list("userprofile_id", "groupaccount_id"):
+        balances[(group_account_id, user_profile_id)] += 0.0
+
+    for transaction in Transaction.objects.using(db_alias).prefetch_related("consumers"):
+        amount = float(transaction.amount)
+        balances[(transaction.group_account_id, transaction.buyer_id)] += amount
+        consumers = transaction.consumers.all()
+        for consumer in consumers:
+            balances[(transaction.group_account_id, consumer.id)] -= amount / len(consumers)
+
+    for transaction in TransactionReal.objects.using(db_alias).all():
+        amount = float(transaction.amount)
+        balances[(transaction.group_account_id, transaction.sender_id)] += amount
+        balances[(transaction.group_account_id, transaction.receiver_id)] -= amount
+
+    GroupBalance.objects.using(db_alias).bulk_create([
+        GroupBalance(group_account_id=group_account_id, user_profile_id=user_profile_id, balance=balance)
+        for (group_account_id, user_profile_id), balance in balances.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groupaccount', '0003_remove_groupaccount_number'),
+        ('userprofile', '0001_initial'),
+        ('transaction', '0005_add_last_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.FloatField(default=0.0)),
+                ('group_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='groupaccount.GroupAccount')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='userprofile.UserProfile')),
+            ],
+            options={
+                'unique_together': {('group_account', 'user_profile')},
+            },
+        ),
+        # Fill the ledger from the existing shares and transactions
+        migrations.RunPython(fill_group_balances, migrations.RunPython.noop),
+    ]
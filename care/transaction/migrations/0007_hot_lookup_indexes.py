@@ -0,0 +1,54 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction', '0006_groupbalance'),
+    ]
+
+    operations = [
+        # the consumers through tables are only indexed on (share, userprofile), not for the consumer side
+        migrations.RunSQL(
+            'CREATE INDEX "transaction_consumer_share_idx" ON "transaction_transaction_consumers" ("userprofile_id", "transaction_id");',
+            'DROP INDEX "transaction_consumer_share_idx";',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX "recurring_consumer_share_idx" ON "transaction_transactionrecurring_consumers" ("userprofile_id", "transactionrecurring_id");',
+            'DROP INDEX "recurring_consumer_share_idx";',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['group_account', 'buyer'], name='transaction_group_buyer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['buyer', 'last_modified'], name='transaction_buyer_lm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionreal',
+            index=models.Index(fields=['group_account', 'sender'], name='real_group_sender_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionreal',
+            index=models.Index(fields=['group_account', 'receiver'], name='real_group_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionreal',
+            index=models.Index(fields=['sender', 'last_modified'], name='real_sender_lm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionreal',
+            index=models.Index(fields=['receiver', 'last_modified'], name='real_receiver_lm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecurring',
+            index=models.Index(fields=['group_account', 'buyer'], name='recurring_group_buyer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecurring',
+            index=models.Index(fields=['buyer', 'last_modified'], name='recurring_buyer_lm_idx'),
+        ),
+    ]
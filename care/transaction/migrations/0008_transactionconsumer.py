@@ -0,0 +1,110 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:40
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+
+
+def split(amount, weights, rotation=0):
+    """ Copy of TransactionConsumer.split at the time of this migration """
+    total_weight = sum(weights)
+    cents = int(abs(amount) * 100)
+    if total_weight == 0:
+        return [Decimal('0.00') for weight in weights]
+    parts = [cents * weight // total_weight for weight in weights]
+    by_remainder = sorted(
+        range(len(weights)),
+        key=lambda i: (-(cents * weights[i] % total_weight), (i - rotation) % len(weights))
+    )
+    for i in by_remainder[:cents - sum(parts)]:
+        parts[i] += 1
+    sign = -1 if amount < 0 else 1
+    return [Decimal(sign * part) / 100 for part in parts]
+
+
+def fill_consumer_amounts(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Transaction = apps.get_model("transaction", "Transaction")
+    TransactionConsumer = apps.get_model("transaction", "TransactionConsumer")
+    GroupBalance = apps.get_model("transaction", "GroupBalance")
+
+    shares = {
+        transaction_id: (amount, group_account_id)
+        for transaction_id, amount, group_account_id
+        in Transaction.objects.using(db_alias).values_list("id", "amount", "group_account_id")
+    }
+    rows = TransactionConsumer.objects.using(db_alias).order_by("transaction_id", "userprofile_id")
+    consumers = {}
+    for row in rows:
+        consumers.setdefault(row.transaction_id, []).append(row)
+    # the ledger holds equal float parts, move it to the parts rounded to cents
+    ledger_deltas = defaultdict(float)
+    for transaction_id, transaction_consumers in consumers.items():
+        amount, group_account_id = shares[transaction_id]
+        parts = split(amount, [row.weight for row in transaction_consumers], transaction_id)
+        for row, part in zip(transaction_consumers, parts):
+            row.amount = part
+            ledger_deltas[(group_account_id, row.userprofile_id)] += \
+                float(amount) / len(transaction_consumers) - float(part)
+    TransactionConsumer.objects.using(db_alias).bulk_update(
+        [row for transaction_consumers in consumers.values() for row in transaction_consumers],
+        ["amount"],
+        batch_size=500,
+    )
+    for (group_account_id, user_profile_id), delta in ledger_deltas.items():
+        GroupBalance.objects.using(db_alias).filter(
+            group_account_id=group_account_id, user_profile_id=user_profile_id
+        ).update(balance=F("balance") + delta)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0001_initial'),
+        ('transaction', '0007_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        # the table, its unique constraint and the consumer index already exist, this only
+        # makes the auto-created through model of Transaction.consumers an explicit one
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='TransactionConsumer',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transaction.Transaction')),
+                        ('userprofile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='userprofile.UserProfile')),
+                    ],
+                    options={
+                        'db_table': 'transaction_transaction_consumers',
+                        'unique_together': {('transaction', 'userprofile')},
+                    },
+                ),
+                migrations.AddIndex(
+                    model_name='transactionconsumer',
+                    index=models.Index(fields=['userprofile', 'transaction'], name='transaction_consumer_share_idx'),
+                ),
+                migrations.AlterField(
+                    model_name='transaction',
+                    name='consumers',
+                    field=models.ManyToManyField(related_name='consumers', through='transaction.TransactionConsumer', to='userprofile.UserProfile'),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.AddField(
+            model_name='transactionconsumer',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='transactionconsumer',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.RunPython(fill_consumer_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:43
+
+import datetime
+
+from django.db import migrations, models
+
+
+def fill_next_due(apps, schema_editor):
+    """ Copy of TransactionRecurring.compute_next_due at the time of this migration """
+    TransactionRecurring = apps.get_model("transaction", "TransactionRecurring")
+    recurring_shares = list(TransactionRecurring.objects.using(schema_editor.connection.alias))
+    for recurring_share in recurring_shares:
+        not_before = datetime.datetime.combine(
+            recurring_share.last_occurrence.date() + datetime.timedelta(days=1),
+            datetime.time(0))
+        recurring_share.next_due = recurring_share.every.after(max(not_before, recurring_share.date))
+    TransactionRecurring.objects.using(schema_editor.connection.alias).bulk_update(
+        recurring_shares, ["next_due"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction', '0008_transactionconsumer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionrecurring',
+            name='next_due',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transactionrecurring',
+            index=models.Index(fields=['next_due'], name='recurring_next_due_idx'),
+        ),
+        migrations.RunPython(fill_next_due, migrations.RunPython.noop),
+    ]
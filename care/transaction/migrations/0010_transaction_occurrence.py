@@ -0,0 +1,50 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:44
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def refill_next_due(apps, schema_editor):
+    """ Copy of TransactionRecurring.compute_next_due at the time of this migration, which
+    anchors the rule on its start date instead of on the time it is evaluated """
+    TransactionRecurring = apps.get_model("transaction", "TransactionRecurring")
+    recurring_shares = list(TransactionRecurring.objects.using(schema_editor.connection.alias))
+    for recurring_share in recurring_shares:
+        not_before = datetime.datetime.combine(
+            recurring_share.last_occurrence.date() + datetime.timedelta(days=1),
+            datetime.time(0))
+        recurring_share.next_due = recurring_share.every.after(
+            max(not_before, recurring_share.date.replace(microsecond=0)),
+            inc=True,
+            dtstart=recurring_share.every.dtstart or recurring_share.date.replace(microsecond=0),
+        )
+    TransactionRecurring.objects.using(schema_editor.connection.alias).bulk_update(
+        recurring_shares, ["next_due"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction', '0009_recurring_next_due'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='occurrence_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='recurring',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='transaction.TransactionRecurring'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='transaction',
+            unique_together={('recurring', 'occurrence_date')},
+        ),
+        migrations.RunPython(refill_next_due, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:32
+
+from django.db import migrations, models
+
+
+def round_group_balances(apps, schema_editor):
+    """ The float ledger drifted by fractions of a cent, store every balance rounded to the cent """
+    db_alias = schema_editor.connection.alias
+    GroupBalance = apps.get_model("transaction", "GroupBalance")
+    balances = list(GroupBalance.objects.using(db_alias).all())
+    for balance in balances:
+        balance.balance = round(balance.balance, 2)
+    GroupBalance.objects.using(db_alias).bulk_update(balances, ["balance"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction', '0010_transaction_occurrence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='groupbalance',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(round_group_balances, migrations.RunPython.noop),
+    ]
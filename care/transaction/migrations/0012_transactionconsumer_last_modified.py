@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:37
+
+import datetime
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_last_modified(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Transaction = apps.get_model("transaction", "Transaction")
+    TransactionConsumer = apps.get_model("transaction", "TransactionConsumer")
+    TransactionConsumer.objects.using(db_alias).update(last_modified=Subquery(
+        Transaction.objects.using(db_alias).filter(id=OuterRef("transaction_id")).values("last_modified")[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction', '0011_groupbalance_decimal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionconsumer',
+            name='last_modified',
+            field=models.DateTimeField(default=datetime.datetime.now, editable=False),
+        ),
+        # Give every consumer row the last_modified of its share before it is indexed
+        migrations.RunPython(copy_last_modified, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transactionconsumer',
+            index=models.Index(fields=['userprofile', 'last_modified', 'transaction'], name='transaction_consumer_lm_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groupaccount', '0003_remove_groupaccount_number'),
+        ('userprofile', '0001_initial'),
+        ('transaction', '0012_transactionconsumer_last_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('group_account', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='history_version', to='groupaccount.GroupAccount')),
+                ('user_profile', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='history_version', to='userprofile.UserProfile')),
+            ],
+        ),
+    ]
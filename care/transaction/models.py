@@ -1,68 +1,92 @@
 import logging
 import datetime
+from collections import defaultdict
+from decimal import Decimal
 from itertools import chain
 
-from django.db import models
-from django.db.models import Count, F, ExpressionWrapper
+from django.db import models, transaction as db_transaction
+from django.db.models import Case, Count, Exists, ExpressionWrapper, F, Func, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 
-from care.fields.recurrencefield import RecurrenceField
+from care.base.pagination import KeysetSource
+from care.fields.recurrencefield import RecurrenceField, recurrence_text
+from care.groupaccount import groupcache
 
 from care.groupaccount.models import GroupAccount
 from care.userprofile.models import UserProfile
 
 logger = logging.getLogger(__name__)
 
-def _merge_on_last_modified(l1, l2):
-    """ Takes two iterables l1, l2 of objects with a `last_modified` attribute. Assumes
-    the iterables are sorted (desc. order) on this attribute, and merges them into a
-    single sorted list """
-
-    il1 = iter(l1)
-    il2 = iter(l2)
-    out = []
-
-    try:
-        next_l1 = next(il1)
-    except StopIteration:
-        next_l1 = None
-    try:
-        next_l2 = next(il2)
-    except StopIteration:
-        next_l2 = None
-
-    # Merge while both lists have elements
-    while next_l1 is not None and next_l2 is not None:
-        if next_l1.last_modified > next_l2.last_modified:
-            out.append(next_l1)
-            try:
-                next_l1 = next(il1)
-            except StopIteration:
-                next_l1 = None
-        else:
-            out.append(next_l2)
-            try:
-                next_l2 = next(il2)
-            except StopIteration:
-                next_l2 = None
-
-    if next_l1 is not None:
-        out.append(next_l1)
-        for elt in il1:
-            out.append(elt)
-    if next_l2 is not None:
-        out.append(next_l2)
-        for elt in il2:
-            out.append(elt)
-
-    return out
+def list_source(queryset, last_modified='last_modified', id='id'):
+    """ KeysetSource of queryset that selects and prefetches everything the list templates show of a
+    transaction, as declared by list_select_related on its model. The prefetches run on the rows of a
+    page only, once for all sources of a model, so a list renders in a constant number of queries """
+    model = queryset.model
+    prefetch = [Prefetch('modifications', queryset=Modification.objects.select_related('user'))]
+    if model is not TransactionReal:
+        prefetch.append(Prefetch('consumers', queryset=UserProfile.objects.only('id', 'displayname')))
+    return KeysetSource(queryset.select_related(*model.list_select_related), last_modified, id, prefetch)
+
+
+def _share_history(model, userprofile_id):
+    """ The shares of model the user profile bought or consumed as two KeysetSources, newest first: the
+    shares it bought and the ones it only consumed, so each share is in one of them. The signed
+    amount_per_person_float is what the share adds to the balance of the user profile: the amount
+    if it bought the share, minus its part of the amount if it is one of the consumers.
+
+    Both sources are walked along an index, the bought shares on (buyer, last_modified) and the consumed
+    shares of Transaction on the copy of last_modified in its consumers table. An OR of the two would
+    sort the whole history of the user profile for every page. """
+    through = model.consumers.through
+    share_field = model.consumers.field.m2m_field_name()
+    consumer_rows = through.objects.filter(**{share_field: OuterRef('pk')}).order_by()
+    if model is Transaction:
+        # shares store the part of every consumer
+        own_part = Coalesce(Subquery(consumer_rows.filter(userprofile_id=userprofile_id).values('amount')), Value(0))
+        bought = model.objects.filter(buyer_id=userprofile_id).annotate(
+            amount_per_person_float=ExpressionWrapper(F('amount') - own_part, output_field=models.FloatField())
+        )
+        consumed = model.objects.filter(
+            transactionconsumer__userprofile_id=userprofile_id
+        ).exclude(buyer_id=userprofile_id).annotate(
+            history_last_modified=F('transactionconsumer__last_modified'),
+            history_id=F('transactionconsumer__transaction_id'),
+            amount_per_person_float=ExpressionWrapper(-F('transactionconsumer__amount'), output_field=models.FloatField()),
+        )
+        consumed_key = ('history_last_modified', 'history_id')
+    else:
+        n_consumers = consumer_rows.values(share_field).annotate(n=Count('*')).values('n')
+        own_part = F('amount') / (1.0*Subquery(n_consumers))
+        bought = model.objects.filter(buyer_id=userprofile_id).annotate(
+            is_consumer=Exists(consumer_rows.filter(userprofile_id=userprofile_id)),
+            amount_per_person_float=ExpressionWrapper(
+                F('amount') - Case(
+                    When(is_consumer=True, then=own_part),
+                    default=Value(0.0), output_field=models.FloatField()
+                ),
+                output_field=models.FloatField()
+            )
+        )
+        # a user profile consumes few recurring shares, these are sorted
+        consumed = model.objects.filter(
+            id__in=through.objects.filter(userprofile_id=userprofile_id).values(share_field)
+        ).exclude(buyer_id=userprofile_id).annotate(
+            amount_per_person_float=ExpressionWrapper(-own_part, output_field=models.FloatField())
+        )
+        consumed_key = ('last_modified', 'id')
+    return [
+        list_source(bought),
+        list_source(consumed, *consumed_key),
+    ]
 
 
 class Transaction(models.Model):
     amount = models.DecimalField(max_digits=6, decimal_places=2)
     what = models.CharField(max_length=24)
     buyer = models.ForeignKey(UserProfile, related_name='buyer', on_delete=models.PROTECT)
-    consumers = models.ManyToManyField(UserProfile, related_name='consumers')
+    consumers = models.ManyToManyField(UserProfile, related_name='consumers', through='TransactionConsumer')
     group_account = models.ForeignKey(GroupAccount, on_delete=models.PROTECT)
     comment = models.CharField(max_length=200, blank=True)
     date = models.DateTimeField(default=datetime.datetime.now,
@@ -72,53 +96,104 @@ class Transaction(models.Model):
         editable=False,
         blank=True
     )
+    # set on the occurrences of a recurring share, at most one share per occurrence
+    recurring = models.ForeignKey('TransactionRecurring', related_name='occurrences', null=True, blank=True,
+                                  editable=False, on_delete=models.SET_NULL)
+    occurrence_date = models.DateTimeField(null=True, blank=True, editable=False)
+
+    list_select_related = ('buyer', 'group_account')
+
+    class Meta:
+        unique_together = ('recurring', 'occurrence_date')
+        indexes = [
+            models.Index(fields=['group_account', 'buyer'], name='transaction_group_buyer_idx'),
+            models.Index(fields=['buyer', 'last_modified'], name='transaction_buyer_lm_idx'),
+        ]
 
     def get_datetime_last_modified(self):
         return self.last_modified
 
+    @property
+    def amount_per_person(self):
+        return '%.2f' % self.amount_per_person_float
+
     @staticmethod
-    def get_buyer_transactions(buyer_id):
-        transactions = (
-            Transaction.objects
-            .filter(buyer__id=buyer_id)
-            .order_by("-last_modified")
-            .prefetch_related('modifications', 'group_account')
-        )
-        for transaction in transactions:
-            transaction.amount_per_person = '%.2f' % float(transaction.amount)
-            transaction.amount_per_person_float = float(transaction.amount)
-        return transactions
+    def get_history_sources(userprofile_id):
+        """ KeysetSources of the shares the user profile is part of, see _share_history """
+        return _share_history(Transaction, userprofile_id)
+
+    def update_consumer_amounts(self):
+        """ Splits the amount again after consumer weights were changed directly, and moves the ledger along """
+        old_deltas = _transaction_deltas(self.pk)
+        TransactionConsumer.update_amounts(self.pk)
+        GroupBalance.apply_deltas(old_deltas, _transaction_deltas(self.pk))
+
+    def __str__(self):
+        return self.what
+
+
+class TransactionConsumer(models.Model):
+    """ A consumer of a share with the part of the amount it pays. The parts are split on the
+    weights in whole cents when the share or its consumers change, see update_amounts. """
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE)
+    userprofile = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    weight = models.PositiveIntegerField(default=1)
+    amount = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    # copy of the last_modified of the share, so the shares of a consumer can be walked newest first on an index
+    last_modified = models.DateTimeField(default=datetime.datetime.now, editable=False)
+
+    class Meta:
+        db_table = 'transaction_transaction_consumers'
+        unique_together = ('transaction', 'userprofile')
+        indexes = [
+            models.Index(fields=['userprofile', 'transaction'], name='transaction_consumer_share_idx'),
+            models.Index(fields=['userprofile', 'last_modified', 'transaction'], name='transaction_consumer_lm_idx'),
+        ]
 
     @staticmethod
-    def get_consumer_transactions(consumer_id):
-        transactions = (
-            Transaction.objects
-            .annotate(
-                amount_per_person=ExpressionWrapper(
-                    F('amount') / (1.0*Count('consumers')),
-                    output_field=models.FloatField()
-                )
-            ).filter(consumers__id=consumer_id)
-            .order_by("-last_modified")
-            .prefetch_related('modifications', 'group_account')
+    def split(amount, weights, rotation=0):
+        """ Splits amount over the weights in whole cents that add up to amount exactly.
+        Cents left over go to the largest remainders. Ties start at index rotation (modulo the
+        number of weights), pass the share id so no consumer always pays the leftover cents. """
+        total_weight = sum(weights)
+        cents = int(abs(amount) * 100)
+        if total_weight == 0:
+            return [Decimal('0.00') for weight in weights]
+        parts = [cents * weight // total_weight for weight in weights]
+        by_remainder = sorted(
+            range(len(weights)),
+            key=lambda i: (-(cents * weights[i] % total_weight), (i - rotation) % len(weights))
         )
-
-        for transaction in transactions:
-            transaction.amount_per_person_float = float((-1*transaction.amount_per_person))
-            transaction.amount_per_person = '%.2f' % float(-1 * transaction.amount_per_person)
-        return transactions
+        for i in by_remainder[:cents - sum(parts)]:
+            parts[i] += 1
+        sign = -1 if amount < 0 else 1
+        return [Decimal(sign * part) / 100 for part in parts]
 
     @staticmethod
-    def get_transactions_sorted_by_last_modified(userprofile_id):
-        buyer_transactions = Transaction.get_buyer_transactions(userprofile_id)
-        consumer_transactions = Transaction.get_consumer_transactions(userprofile_id)
-        transactions_all = _merge_on_last_modified(
-            buyer_transactions, consumer_transactions
+    def update_amounts(transaction_id):
+        """ Stores the part of every consumer of a share, splitting its current amount on the weights """
+        amount = Transaction.objects.filter(id=transaction_id).values_list('amount', flat=True).first()
+        rows = list(
+            TransactionConsumer.objects.filter(transaction_id=transaction_id)
+            .order_by('userprofile_id')
+            .values_list('id', 'weight', 'amount')
         )
-        return transactions_all
+        if amount is None or not rows:
+            return
+        parts = TransactionConsumer.split(amount, [weight for row_id, weight, row_amount in rows], transaction_id)
+        for (row_id, weight, row_amount), part in zip(rows, parts):
+            if row_amount != part:
+                TransactionConsumer.objects.filter(id=row_id).update(amount=part)
+
+    @staticmethod
+    def update_last_modified(transaction_ids):
+        """ Copies the last_modified of the shares to their consumer rows, in one query """
+        TransactionConsumer.objects.filter(transaction_id__in=transaction_ids).update(last_modified=Subquery(
+            Transaction.objects.filter(id=OuterRef('transaction_id')).values('last_modified')[:1]
+        ))
 
     def __str__(self):
-        return self.what
+        return str(self.userprofile_id) + ' in ' + str(self.transaction_id) + ': ' + '%.2f' % self.amount
 
 
 class TransactionRecurring(models.Model):
@@ -141,90 +216,137 @@ class TransactionRecurring(models.Model):
         default=datetime.datetime.fromtimestamp(0),
         editable=False,
         blank=True)
+    # stored compute_next_due(), null when there is no next occurrence
+    next_due = models.DateTimeField(null=True, editable=False, blank=True)
 
-    @property
-    def next_due(self):
-        ''' Get the next occurrence date for this recurring event '''
+    list_select_related = ('buyer', 'group_account')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group_account', 'buyer'], name='recurring_group_buyer_idx'),
+            models.Index(fields=['buyer', 'last_modified'], name='recurring_buyer_lm_idx'),
+            models.Index(fields=['next_due'], name='recurring_next_due_idx'),
+        ]
+
+    def _first_possible_due(self):
+        ''' At most one occurrence per day, and none before the start date '''
         not_before = datetime.datetime.combine(
             self.last_occurrence.date() + datetime.timedelta(days=1),
             datetime.time(0))
+        return max(not_before, self.date.replace(microsecond=0))
+
+    def _dtstart(self):
+        ''' The rule counts from its own start, or else from the start date of the share '''
+        return self.every.dtstart or self.date.replace(microsecond=0)
+
+    def compute_next_due(self):
+        ''' Get the next occurrence date for this recurring event '''
+        return self.every.after(self._first_possible_due(), inc=True, dtstart=self._dtstart())
 
-        return self.every.after(max(not_before, self.date))
+    def due_dates(self, until):
+        ''' Get the occurrence dates that are due up to until, the missed ones included '''
+        return self.every.between(self._first_possible_due(), until, inc=True, dtstart=self._dtstart())
 
     @property
     def period_str(self):
         ''' Get the textual description of the period '''
-        descrs = []
-        for rule in self.every.rrules:
-            descrs.append(rule.to_text())
-        return '; '.join(descrs)
-
-    def create_occurrence(self):
-        ''' Create an occurrence of this event and update it '''
-        transaction = Transaction(
-            amount=self.amount,
-            what=self.what,
-            buyer=self.buyer,
-            group_account=self.group_account,
-            comment=self.comment,
-            date=datetime.datetime.now(),
-        )
+        return recurrence_text(self.every)
+
+    def create_occurrences(self, until, batch_size=100):
+        ''' Create a share for every occurrence due up to until, in one database transaction per batch '''
+        created = 0
+        while True:
+            with db_transaction.atomic():
+                # the lock and the unique (recurring, occurrence_date) make concurrent and repeated runs harmless
+                recurring = TransactionRecurring.objects.select_for_update().get(pk=self.pk)
+                dates = recurring.due_dates(until)[:batch_size]
+                if not dates:
+                    break
+                created += recurring._create_occurrence_batch(dates)
+                recurring.last_occurrence = dates[-1]
+                recurring.save()
+        return created
+
+    def _create_occurrence_batch(self, dates):
+        existing = set(self.occurrences.filter(occurrence_date__in=dates).values_list('occurrence_date', flat=True))
+        dates = [date for date in dates if date not in existing]
+        if not dates:
+            return 0
+        now = datetime.datetime.now()
+        transactions = [
+            Transaction(
+                amount=self.amount,
+                what=self.what,
+                buyer_id=self.buyer_id,
+                group_account_id=self.group_account_id,
+                comment=self.comment,
+                date=date,
+                last_modified=now,
+                recurring=self,
+                occurrence_date=date,
+            )
+            for date in dates
+        ]
         try:
-            transaction.full_clean()
+            transactions[0].full_clean(validate_unique=False)
         except ValidationError:
-            return  # FIXME do something better
+            logger.warning('recurring share ' + str(self.id) + ' has no valid occurrence')
+            return 0
+
+        # bulk inserts skip the ledger signals, the consumer parts and balances are written here
+        Transaction.objects.bulk_create(transactions, ignore_conflicts=True)
+        # the inserts that conflicted with occurrences another run created meanwhile were skipped, only the
+        # rows written here (the ones with this batch's last_modified) get consumers and move the ledger
+        transaction_ids = list(
+            self.occurrences.filter(occurrence_date__in=dates, last_modified=now).values_list('id', flat=True)
+        )
+        if not transaction_ids:
+            return 0
+        consumer_ids = sorted(self.consumers.values_list('id', flat=True))
+        parts = {
+            transaction_id: TransactionConsumer.split(self.amount, [1 for consumer_id in consumer_ids], transaction_id)
+            for transaction_id in transaction_ids
+        }
+        TransactionConsumer.objects.bulk_create([
+            TransactionConsumer(transaction_id=transaction_id, userprofile_id=consumer_id, amount=part, last_modified=now)
+            for transaction_id in transaction_ids
+            for consumer_id, part in zip(consumer_ids, parts[transaction_id])
+        ], ignore_conflicts=True)
+
+        deltas = defaultdict(Decimal)
+        deltas[(self.group_account_id, self.buyer_id)] += self.amount * len(transaction_ids)
+        for transaction_id in transaction_ids:
+            for consumer_id, part in zip(consumer_ids, parts[transaction_id]):
+                deltas[(self.group_account_id, consumer_id)] -= part
+        GroupBalance.apply_deltas({}, deltas)
+        _bump_group_versions(list(deltas) + [(self.group_account_id, None)])
+        # bulk inserts send no signals either
+        HistoryVersion.bump([self.group_account_id], [user_profile_id for group_account_id, user_profile_id in deltas])
+        return len(transaction_ids)
 
-        transaction.save()
-        for consumer in self.consumers.all():
-            transaction.consumers.add(consumer)
-        transaction.save()
-        self.last_occurrence = datetime.datetime.now()
-        self.save()
+    @staticmethod
+    def create_due_occurrences(until=None, shard=0, n_shards=1):
+        ''' Create the due occurrences of every recurring share, the ones missed since its last occurrence included.
+        With n_shards, only the recurring shares of the groups in the shard. '''
+        from care.base.shards import in_shard
+        until = until or datetime.datetime.now()
+        created = 0
+        due = in_shard(TransactionRecurring.objects.filter(next_due__lte=until), 'group_account_id', shard, n_shards)
+        for recurring in due:
+            created += recurring.create_occurrences(until)
+        return created
 
     def get_datetime_last_modified(self):
         return self.last_modified
 
-    @staticmethod
-    def get_buyer_transactions(buyer_id):
-        transactions = TransactionRecurring.objects \
-            .filter(buyer__id=buyer_id).order_by("-date") \
-            .prefetch_related('modifications', 'group_account')
-        for transaction in transactions:
-            transaction.amount_per_person = '%.2f' % float(transaction.amount)
-            transaction.amount_per_person_float = float(transaction.amount)
-        return transactions
-
-    @staticmethod
-    def get_consumer_transactions(consumer_id):
-        transactions = (
-            TransactionRecurring.objects
-            .annotate(
-                amount_per_person=ExpressionWrapper(
-                    F('amount') / (1.0*Count('consumers')),
-                    output_field=models.FloatField())
-            )
-            .filter(consumers__id=consumer_id)
-            .order_by("-date")
-            .prefetch_related('modifications', 'group_account')
-        )
-
-        for transaction in transactions:
-            transaction.amount_per_person_float = \
-                float((-1*transaction.amount_per_person))
-            transaction.amount_per_person = \
-                '%.2f' % float(-1 * transaction.amount_per_person)
-        return transactions
+    @property
+    def amount_per_person(self):
+        return '%.2f' % self.amount_per_person_float
 
     @staticmethod
-    def get_transactions_sorted_by_last_modified(userprofile_id):
-        buyer_transactions = \
-            TransactionRecurring.get_buyer_transactions(userprofile_id)
-        consumer_transactions = \
-            TransactionRecurring.get_consumer_transactions(userprofile_id)
-        transactions_all = _merge_on_last_modified(
-            buyer_transactions, consumer_transactions
-        )
-        return transactions_all
+    def get_history_sources(userprofile_id):
+        """ KeysetSources of the recurring shares the user profile is part of, see _share_history """
+        return _share_history(TransactionRecurring, userprofile_id)
 
     def __str__(self):
         return self.what
@@ -244,43 +366,36 @@ class TransactionReal(models.Model):
         blank=True
     )
 
+    list_select_related = ('sender', 'receiver', 'group_account')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group_account', 'sender'], name='real_group_sender_idx'),
+            models.Index(fields=['group_account', 'receiver'], name='real_group_receiver_idx'),
+            models.Index(fields=['sender', 'last_modified'], name='real_sender_lm_idx'),
+            models.Index(fields=['receiver', 'last_modified'], name='real_receiver_lm_idx'),
+        ]
+
     def get_datetime_last_modified(self):
         return self.last_modified
 
-    @staticmethod
-    def get_transactions_real_sent(sender_id):
-        transactions = (
-            TransactionReal.objects
-            .filter(sender__id=sender_id)
-            .order_by("-date")
-            .prefetch_related('modifications', 'group_account')
-        )
-        for transaction in transactions:
-            transaction.amount_per_person = '%.2f' % transaction.amount
-            transaction.amount_per_person_float = float(transaction.amount)
-        return transactions
+    @property
+    def amount_per_person(self):
+        return '%.2f' % self.amount
 
-    @staticmethod
-    def get_transactions_real_received(receiver_id):
-        transactions = (
-            TransactionReal.objects
-            .filter(receiver__id=receiver_id)
-            .order_by("-date")
-            .prefetch_related('modifications', 'group_account')
-        )
-        for transaction in transactions:
-            transaction.amount_per_person = '%.2f' % transaction.amount
-            transaction.amount_per_person_float = float(transaction.amount)
-        return transactions
+    @property
+    def amount_per_person_float(self):
+        return float(self.amount)
 
     @staticmethod
-    def get_transactions_real_sorted_by_last_modified(userprofile_id):
-        sent_transactions = TransactionReal.get_transactions_real_sent(userprofile_id)
-        received_transactions = TransactionReal.get_transactions_real_received(userprofile_id)
-        transactions_real_all = _merge_on_last_modified(
-            sent_transactions, received_transactions
-        )
-        return transactions_real_all
+    def get_history_sources(userprofile_id):
+        """ KeysetSources of the real transactions the user profile sent and of the ones it only received.
+        Each is walked along its (sender or receiver, last_modified) index, an OR of the two would sort
+        all real transactions of the user profile for every page. """
+        return [
+            list_source(TransactionReal.objects.filter(sender_id=userprofile_id)),
+            list_source(TransactionReal.objects.filter(receiver_id=userprofile_id).exclude(sender_id=userprofile_id)),
+        ]
 
     def __str__(self):
         return self.comment
@@ -298,3 +413,316 @@ class Modification(models.Model):
                                               blank=True, null=True,
                                               related_name='modifications',
                                               on_delete=models.SET_NULL)
+
+
+class _RoundCents(Func):
+    """ ROUND(expression, 2). SQLite stores a DecimalField as a float, rounding every update keeps
+    it on the closest float of the amount in cents instead of drifting away from it. """
+    function = 'ROUND'
+    template = '%(function)s(%(expressions)s, 2)'
+    output_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+class GroupBalance(models.Model):
+    """ Ledger row holding the balance of one user profile in one group account.
+    Kept up to date by the signal handlers below, so reading a balance is a single
+    indexed lookup instead of the aggregates in `UserProfile.compute_balance`. """
+    group_account = models.ForeignKey(GroupAccount, related_name='balances', on_delete=models.CASCADE)
+    user_profile = models.ForeignKey(UserProfile, related_name='balances', on_delete=models.CASCADE)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('group_account', 'user_profile')
+
+    @staticmethod
+    def get_balance(group_account_id, user_profile_id):
+        balance = GroupBalance.objects.filter(
+            group_account_id=group_account_id,
+            user_profile_id=user_profile_id
+        ).values_list('balance', flat=True).first()
+        if balance is None:
+            return Decimal('0.00')
+        return balance
+
+    @staticmethod
+    def apply_deltas(old_deltas, new_deltas):
+        """ Moves the ledger from the contribution `old_deltas` to `new_deltas`, both
+        dicts of Decimal balance changes keyed on (group_account_id, user_profile_id) """
+        with db_transaction.atomic():
+            for key in set(old_deltas) | set(new_deltas):
+                delta = new_deltas.get(key, 0) - old_deltas.get(key, 0)
+                if delta == 0:
+                    continue
+                group_account_id, user_profile_id = key
+                balance, created = GroupBalance.objects.get_or_create(
+                    group_account_id=group_account_id,
+                    user_profile_id=user_profile_id
+                )
+                GroupBalance.objects.filter(id=balance.id).update(balance=_RoundCents(F('balance') + delta))
+
+    def __str__(self):
+        return str(self.user_profile_id) + '@' + str(self.group_account_id) + ': ' + '%.2f' % self.balance
+
+
+class HistoryVersion(models.Model):
+    """ Counter of the changes to the shares, recurring shares and real transactions of one group
+    account or one user profile. Bumped by the signal handlers below and by the occurrence batches,
+    in the database transaction of the change, so the ETag of a page is one indexed read. """
+    group_account = models.OneToOneField(GroupAccount, null=True, related_name='history_version', on_delete=models.CASCADE)
+    user_profile = models.OneToOneField(UserProfile, null=True, related_name='history_version', on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def bump(group_account_ids, user_profile_ids):
+        group_account_ids = sorted({id for id in group_account_ids if id is not None})
+        user_profile_ids = sorted({id for id in user_profile_ids if id is not None})
+        if not group_account_ids and not user_profile_ids:
+            return
+        # a row is created on the first change, the insert is skipped for the rows that exist
+        HistoryVersion.objects.bulk_create(
+            [HistoryVersion(group_account_id=id) for id in group_account_ids] +
+            [HistoryVersion(user_profile_id=id) for id in user_profile_ids],
+            ignore_conflicts=True
+        )
+        HistoryVersion.objects.filter(
+            Q(group_account_id__in=group_account_ids) | Q(user_profile_id__in=user_profile_ids)
+        ).update(version=F('version') + 1)
+
+    @staticmethod
+    def get_versions(user_profile_id, group_account_ids):
+        """ (version of the user profile, [(group account id, version)]), None for what never changed """
+        versions = {}
+        rows = HistoryVersion.objects.filter(
+            Q(user_profile_id=user_profile_id) | Q(group_account_id__in=group_account_ids)
+        ).values_list('group_account_id', 'version')
+        for group_account_id, version in rows:
+            versions[group_account_id] = version
+        return versions.get(None), [(group_account_id, versions.get(group_account_id)) for group_account_id in group_account_ids]
+
+    def __str__(self):
+        if self.group_account_id is not None:
+            return 'group ' + str(self.group_account_id) + ': ' + str(self.version)
+        return 'user ' + str(self.user_profile_id) + ': ' + str(self.version)
+
+
+def _transaction_deltas(transaction_id):
+    """ Balance changes a share currently contributes to the ledger, read from the database """
+    deltas = defaultdict(Decimal)
+    row = Transaction.objects.filter(id=transaction_id).values('amount', 'buyer_id', 'group_account_id').first()
+    if row is None:
+        return deltas
+    amount = row['amount']
+    group_account_id = row['group_account_id']
+    deltas[(group_account_id, row['buyer_id'])] += amount
+    consumer_amounts = TransactionConsumer.objects.filter(
+        transaction_id=transaction_id
+    ).values_list('userprofile_id', 'amount')
+    for consumer_id, consumer_amount in consumer_amounts:
+        deltas[(group_account_id, consumer_id)] -= consumer_amount
+    return deltas
+
+
+def _transaction_real_deltas(transaction_real_id):
+    """ Balance changes a real transaction currently contributes to the ledger """
+    deltas = defaultdict(Decimal)
+    row = TransactionReal.objects.filter(id=transaction_real_id).values(
+        'amount', 'sender_id', 'receiver_id', 'group_account_id'
+    ).first()
+    if row is None:
+        return deltas
+    amount = row['amount']
+    deltas[(row['group_account_id'], row['sender_id'])] += amount
+    deltas[(row['group_account_id'], row['receiver_id'])] -= amount
+    return deltas
+
+
+_LEDGER_DELTAS = {
+    Transaction: _transaction_deltas,
+    TransactionReal: _transaction_real_deltas,
+}
+
+
+def ledger_pre_change(sender, instance, **kwargs):
+    instance._ledger_deltas = {}
+    if instance.pk is not None:
+        instance._ledger_deltas = _LEDGER_DELTAS[sender](instance.pk)
+
+
+def ledger_post_save(sender, instance, **kwargs):
+    if sender is Transaction:
+        # the ledger reads the stored consumer parts, split them on the new amount first
+        TransactionConsumer.update_amounts(instance.pk)
+    GroupBalance.apply_deltas(getattr(instance, '_ledger_deltas', {}), _LEDGER_DELTAS[sender](instance.pk))
+
+
+def ledger_post_delete(sender, instance, **kwargs):
+    GroupBalance.apply_deltas(getattr(instance, '_ledger_deltas', {}), {})
+
+
+def ledger_consumers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ A change of the consumers changes the share of every consumer of the transaction """
+    if action.startswith('pre_'):
+        if not reverse:
+            transaction_ids = [instance.id]
+        elif pk_set is not None:
+            transaction_ids = list(pk_set)
+        else:
+            transaction_ids = list(instance.consumers.values_list('id', flat=True))
+        instance._ledger_consumer_deltas = {
+            transaction_id: _transaction_deltas(transaction_id) for transaction_id in transaction_ids
+        }
+    elif action.startswith('post_'):
+        for transaction_id, old_deltas in getattr(instance, '_ledger_consumer_deltas', {}).items():
+            TransactionConsumer.update_amounts(transaction_id)
+            GroupBalance.apply_deltas(old_deltas, _transaction_deltas(transaction_id))
+
+
+def history_post_save(sender, instance, **kwargs):
+    """ The consumer rows hold a copy of the last_modified of their share, see _share_history """
+    TransactionConsumer.update_last_modified([instance.pk])
+
+
+def history_consumers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Consumer rows are added with the current time, give them the last_modified of their share """
+    if action == 'post_add':
+        TransactionConsumer.update_last_modified(list(pk_set) if reverse else [instance.pk])
+
+
+post_save.connect(history_post_save, sender=Transaction)
+m2m_changed.connect(history_consumers_changed, sender=Transaction.consumers.through)
+
+
+def next_due_pre_save(sender, instance, **kwargs):
+    """ Stores the next occurrence, so due recurring shares can be selected in SQL """
+    instance.next_due = instance.compute_next_due()
+
+
+pre_save.connect(next_due_pre_save, sender=TransactionRecurring)
+
+
+# keep the GroupBalance ledger in sync with shares and real transactions
+for ledger_model in (Transaction, TransactionReal):
+    pre_save.connect(ledger_pre_change, sender=ledger_model)
+    post_save.connect(ledger_post_save, sender=ledger_model)
+    pre_delete.connect(ledger_pre_change, sender=ledger_model)
+    post_delete.connect(ledger_post_delete, sender=ledger_model)
+m2m_changed.connect(ledger_consumers_changed, sender=Transaction.consumers.through)
+
+
+def _bump_group_versions(deltas):
+    group_account_ids = [group_account_id for group_account_id, user_profile_id in deltas]
+    db_transaction.on_commit(lambda: groupcache.bump_versions(group_account_ids))
+
+
+def groupcache_post_change(sender, instance, **kwargs):
+    """ The old ledger contribution holds the previous group account, if it changed """
+    _bump_group_versions(list(getattr(instance, '_ledger_deltas', {})) + [(instance.group_account_id, None)])
+
+
+def groupcache_consumers_changed(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        for deltas in getattr(instance, '_ledger_consumer_deltas', {}).values():
+            _bump_group_versions(deltas)
+
+
+# cached group balances and statistics become stale, connected after the ledger handlers that stash the deltas
+for ledger_model in (Transaction, TransactionReal):
+    post_save.connect(groupcache_post_change, sender=ledger_model)
+    post_delete.connect(groupcache_post_change, sender=ledger_model)
+m2m_changed.connect(groupcache_consumers_changed, sender=Transaction.consumers.through)
+
+
+def recurring_pre_save(sender, instance, **kwargs):
+    """ Stashes the previous group account and buyer, for the handlers below """
+    instance._groupcache_group_account_id, instance._history_buyer_id = TransactionRecurring.objects.filter(
+        pk=instance.pk
+    ).values_list('group_account_id', 'buyer_id').first() or (None, None)
+
+
+def groupcache_recurring_post_change(sender, instance, **kwargs):
+    """ Recurring shares are part of the cached balance projections of their group """
+    group_account_ids = [instance.group_account_id, getattr(instance, '_groupcache_group_account_id', None)]
+    _bump_group_versions([(group_account_id, None) for group_account_id in group_account_ids if group_account_id is not None])
+
+
+def groupcache_recurring_consumers_changed(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_'):
+        if reverse:
+            group_account_ids = instance.group_accounts.values_list('id', flat=True)
+        else:
+            group_account_ids = [instance.group_account_id]
+        _bump_group_versions([(group_account_id, None) for group_account_id in group_account_ids])
+
+
+pre_save.connect(recurring_pre_save, sender=TransactionRecurring)
+post_save.connect(groupcache_recurring_post_change, sender=TransactionRecurring)
+post_delete.connect(groupcache_recurring_post_change, sender=TransactionRecurring)
+m2m_changed.connect(groupcache_recurring_consumers_changed, sender=TransactionRecurring.consumers.through)
+
+
+def _bump_history_versions(deltas, group_account_ids=(), user_profile_ids=()):
+    HistoryVersion.bump(
+        [group_account_id for group_account_id, user_profile_id in deltas] + list(group_account_ids),
+        [user_profile_id for group_account_id, user_profile_id in deltas] + list(user_profile_ids)
+    )
+
+
+def history_version_post_change(sender, instance, **kwargs):
+    """ The old ledger contribution holds the previous group account, buyer or sender and receiver, and consumers """
+    if sender is Transaction:
+        user_profile_ids = [instance.buyer_id]
+    else:
+        user_profile_ids = [instance.sender_id, instance.receiver_id]
+    _bump_history_versions(getattr(instance, '_ledger_deltas', {}), [instance.group_account_id], user_profile_ids)
+
+
+def history_version_consumers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('post_'):
+        keys = [key for deltas in getattr(instance, '_ledger_consumer_deltas', {}).values() for key in deltas]
+        _bump_history_versions(keys, user_profile_ids=[instance.id] if reverse else (pk_set or []))
+
+
+def history_version_recurring_pre_delete(sender, instance, **kwargs):
+    instance._history_consumer_ids = list(instance.consumers.values_list('id', flat=True))
+
+
+def history_version_recurring_post_save(sender, instance, **kwargs):
+    HistoryVersion.bump(
+        [instance.group_account_id, getattr(instance, '_groupcache_group_account_id', None)],
+        [instance.buyer_id, getattr(instance, '_history_buyer_id', None)] + list(instance.consumers.values_list('id', flat=True))
+    )
+
+
+def history_version_recurring_post_delete(sender, instance, **kwargs):
+    HistoryVersion.bump([instance.group_account_id], [instance.buyer_id] + getattr(instance, '_history_consumer_ids', []))
+
+
+def history_version_recurring_consumers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._history_consumer_ids = list(instance.consumers.values_list('id', flat=True))
+    elif action.startswith('post_') and reverse:
+        if pk_set is None:
+            group_account_ids = instance.group_accounts.values_list('id', flat=True)
+            user_profile_ids = []
+        else:
+            recurring = TransactionRecurring.objects.filter(id__in=pk_set).values_list('group_account_id', 'buyer_id')
+            group_account_ids = [group_account_id for group_account_id, buyer_id in recurring]
+            user_profile_ids = [buyer_id for group_account_id, buyer_id in recurring]
+        HistoryVersion.bump(group_account_ids, [instance.id] + user_profile_ids)
+    elif action.startswith('post_'):
+        consumer_ids = pk_set if pk_set is not None else getattr(instance, '_history_consumer_ids', [])
+        HistoryVersion.bump(
+            [instance.group_account_id],
+            [instance.buyer_id] + list(consumer_ids) + list(instance.consumers.values_list('id', flat=True))
+        )
+
+
+# the history versions of the pages, connected after the ledger handlers that stash the deltas
+for ledger_model in (Transaction, TransactionReal):
+    post_save.connect(history_version_post_change, sender=ledger_model)
+    post_delete.connect(history_version_post_change, sender=ledger_model)
+m2m_changed.connect(history_version_consumers_changed, sender=Transaction.consumers.through)
+pre_delete.connect(history_version_recurring_pre_delete, sender=TransactionRecurring)
+post_save.connect(history_version_recurring_post_save, sender=TransactionRecurring)
+post_delete.connect(history_version_recurring_post_delete, sender=TransactionRecurring)
+m2m_changed.connect(history_version_recurring_consumers_changed, sender=TransactionRecurring.consumers.through)
@@ -0,0 +1,311 @@
+import datetime
+import timeit
+from decimal import Decimal
+from unittest import skipUnless
+
+import recurrence
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from care.base.pagination import KeysetPaginator
+from care.fields.recurrencefield import recurrence_text
+from care.groupaccount.models import GroupAccount
+from care.transaction.models import GroupBalance, Transaction, TransactionConsumer, TransactionReal, TransactionRecurring
+from care.userprofile.models import NotificationInterval, UserProfile
+
+
+class SplitTest(TestCase):
+
+    def test_parts_add_up(self):
+        for amount in (Decimal('0.01'), Decimal('10.00'), Decimal('-7.01'), Decimal('99.99')):
+            parts = TransactionConsumer.split(amount, [1, 2, 3])
+            self.assertEqual(sum(parts), amount)
+
+    def test_largest_remainder_first(self):
+        self.assertEqual(TransactionConsumer.split(Decimal('1.00'), [1, 2]), [Decimal('0.33'), Decimal('0.67')])
+
+    def test_tie_rotates(self):
+        for rotation in range(6):
+            parts = TransactionConsumer.split(Decimal('0.01'), [1, 1, 1], rotation)
+            self.assertEqual(parts.index(Decimal('0.01')), rotation % 3)
+
+
+class ShareSplitTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.group_account = GroupAccount.objects.create(name='group')
+        cls.user_profiles = []
+        for i in range(3):
+            user = User.objects.create_user('user' + str(i), 'user' + str(i) + '@example.com', 'password')
+            user_profile = UserProfile.objects.get(user=user)
+            user_profile.group_accounts.add(cls.group_account)
+            cls.user_profiles.append(user_profile)
+
+    def test_leftover_cents_are_spread_over_the_consumers(self):
+        # 1.00 over three consumers leaves a cent, no consumer should pay it every time
+        for i in range(30):
+            transaction = Transaction.objects.create(
+                amount=Decimal('1.00'), what='share', buyer=self.user_profiles[0], group_account=self.group_account
+            )
+            transaction.consumers.set(self.user_profiles)
+        for user_profile in self.user_profiles:
+            amounts = TransactionConsumer.objects.filter(userprofile=user_profile).values_list('amount', flat=True)
+            self.assertEqual(sum(amounts), Decimal('10.00'))
+
+        balances = GroupBalance.objects.filter(group_account=self.group_account)
+        self.assertEqual(sum(balance.balance for balance in balances), Decimal('0.00'))
+        self.assertEqual(GroupBalance.get_balance(self.group_account.id, self.user_profiles[1].id), Decimal('-10.00'))
+
+    def test_ledger_does_not_drift(self):
+        # 0.10 has no exact float, a thousand float additions of it are off by fractions of a cent
+        key = (self.group_account.id, self.user_profiles[2].id)
+        for i in range(1000):
+            GroupBalance.apply_deltas({}, {key: Decimal('0.10')})
+        self.assertEqual(GroupBalance.get_balance(*key), Decimal('100.00'))
+        self.assertEqual(
+            GroupBalance.objects.filter(group_account_id=key[0], user_profile_id=key[1], balance=Decimal('100.00')).count(), 1
+        )
+
+
+class RecurrenceTextTest(SimpleTestCase):
+
+    def test_cache_beats_the_direct_description(self):
+        value = recurrence.deserialize('RRULE:FREQ=WEEKLY;BYDAY=MO,TH')
+        def direct():
+            return '; '.join(rule.to_text() for rule in value.rrules)
+        self.assertEqual(recurrence_text(value), direct())
+        # the best of a few runs, so a busy machine does not decide the outcome
+        cached_time = min(timeit.repeat(lambda: recurrence_text(value), number=200, repeat=5))
+        direct_time = min(timeit.repeat(direct, number=200, repeat=5))
+        self.assertLess(cached_time, direct_time)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PageQueriesTest(TestCase):
+    """ The pages that show transactions use a fixed number of queries, however many transactions there are """
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.group_account = GroupAccount.objects.create(name='flatmates')
+        cls.user_profiles = []
+        for i in range(3):
+            user = User.objects.create_user('user' + str(i), 'user' + str(i) + '@example.com', 'password')
+            user_profile = UserProfile.objects.get(user=user)
+            user_profile.group_accounts.add(cls.group_account)
+            cls.user_profiles.append(user_profile)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user_profiles[0].user)
+
+    def add_history(self, n):
+        # the user is buyer, sender and receiver of some rows and only a consumer of others
+        for i in range(n):
+            buyer, receiver = self.user_profiles[i % 2], self.user_profiles[1 - i % 2]
+            transaction = Transaction.objects.create(
+                amount=Decimal('3.00'), what='groceries', buyer=buyer, group_account=self.group_account
+            )
+            transaction.consumers.set(self.user_profiles)
+            TransactionReal.objects.create(
+                amount=Decimal('1.00'), sender=buyer, receiver=receiver, comment='payback', group_account=self.group_account
+            )
+            recurring = TransactionRecurring(
+                amount=Decimal('3.00'), what='house rent', buyer=buyer, group_account=self.group_account,
+                date=datetime.datetime.now(), every=recurrence.deserialize('RRULE:FREQ=WEEKLY')
+            )
+            recurring.save()
+            recurring.consumers.set(self.user_profiles)
+
+    def assert_page_queries(self, path, num, text):
+        for n in (2, 10):
+            self.add_history(n)
+            cache.clear()
+            with self.assertNumQueries(num):
+                response = self.client.get(path)
+            self.assertContains(response, text)
+
+    def test_shares(self):
+        self.assert_page_queries('/transactions/share/0/', 10, 'groceries')
+
+    def test_shares_table(self):
+        self.assert_page_queries('/transactions/share/1/', 10, 'groceries')
+
+    def test_real_transactions(self):
+        self.assert_page_queries('/transactions/real/0/', 9, 'payback')
+
+    def test_recurring_shares(self):
+        self.assert_page_queries('/transactions/recurring/0/', 10, 'house rent')
+
+    def test_home(self):
+        self.assert_page_queries('/', 18, 'flatmates')
+
+    def test_group_accounts(self):
+        self.assert_page_queries('/group/my/0', 9, 'flatmates')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HistoryVersionTest(TestCase):
+    """ The history pages answer 304 with a few indexed reads, until a change of something they show """
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.group_account = GroupAccount.objects.create(name='flatmates')
+        cls.user_profiles = []
+        for i in range(3):
+            user = User.objects.create_user('user' + str(i), 'user' + str(i) + '@example.com', 'password')
+            user_profile = UserProfile.objects.get(user=user)
+            user_profile.group_accounts.add(cls.group_account)
+            cls.user_profiles.append(user_profile)
+        cls.transaction = Transaction.objects.create(
+            amount=Decimal('3.00'), what='groceries', buyer=cls.user_profiles[1], group_account=cls.group_account
+        )
+        cls.transaction.consumers.set(cls.user_profiles)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user_profiles[0].user)
+
+    def get(self, path, etag):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+
+    def assert_changes_etag(self, path, change):
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(self.get(path, etag).status_code, 304)
+        change()
+        response = self.get(path, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_reads_no_history(self):
+        etag = self.client.get('/transactions/share/0/')['ETag']
+        # session, user, user profile, group ids and the history versions, the invite count is cached
+        with self.assertNumQueries(5):
+            self.assertEqual(self.get('/transactions/share/0/', etag).status_code, 304)
+
+    def test_table_view_is_stored_with_the_page(self):
+        etag = self.client.get('/transactions/share/0/')['ETag']
+        response = self.get('/transactions/share/2/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(UserProfile.objects.get(id=self.user_profiles[0].id).showTableView)
+        self.assertEqual(self.get('/transactions/share/2/', response['ETag']).status_code, 304)
+        self.assertEqual(self.get('/transactions/share/0/', response['ETag']).status_code, 304)
+
+    def test_share_edit(self):
+        def change():
+            self.transaction.what = 'bread'
+            self.transaction.save()
+        self.assert_changes_etag('/transactions/share/0/', change)
+
+    def test_share_delete(self):
+        self.assert_changes_etag('/transactions/share/0/', lambda: Transaction.objects.get(id=self.transaction.id).delete())
+
+    def test_consumer_removed(self):
+        self.assert_changes_etag('/transactions/share/0/', lambda: self.transaction.consumers.remove(self.user_profiles[0]))
+
+    def test_real_transaction(self):
+        self.assert_changes_etag('/transactions/real/0/', lambda: TransactionReal.objects.create(
+            amount=Decimal('1.00'), sender=self.user_profiles[1], receiver=self.user_profiles[0],
+            comment='payback', group_account=self.group_account
+        ))
+
+    def test_occurrences(self):
+        recurring = TransactionRecurring(
+            amount=Decimal('3.00'), what='house rent', buyer=self.user_profiles[1], group_account=self.group_account,
+            date=datetime.datetime.now() - datetime.timedelta(days=20), every=recurrence.deserialize('RRULE:FREQ=WEEKLY')
+        )
+        recurring.save()
+        recurring.consumers.set(self.user_profiles)
+        # the bulk inserts of the cron job send no signals
+        self.assert_changes_etag('/transactions/share/0/', lambda: TransactionRecurring.create_due_occurrences())
+
+    def test_history_of_a_former_member(self):
+        # the group version is no longer part of the ETag of a user that left the group
+        self.user_profiles[0].group_accounts.remove(self.group_account)
+        def change():
+            self.transaction.what = 'bread'
+            self.transaction.save()
+        self.assert_changes_etag('/transactions/share/0/', change)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'reads the SQLite query plan')
+class HistoryQueryPlanTest(TestCase):
+    """ Every source of the share and real transaction histories is walked along an index, a page
+    never sorts the whole history of the user profile """
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.user = User.objects.create_user('user', 'user@example.com', 'password')
+        cls.user_profile = UserProfile.objects.get(user=cls.user)
+
+    def assert_no_sort(self, sources):
+        cursor = (datetime.datetime(2020, 1, 1), 1)
+        for source in sources:
+            for queryset in (source.walk(newer=False), source.walk(newer=False, cursor=cursor, inclusive=True)):
+                plan = queryset[:26].explain()
+                self.assertNotIn('TEMP B-TREE', plan)
+                self.assertIn('INDEX', plan)
+
+    def test_shares(self):
+        self.assert_no_sort(Transaction.get_history_sources(self.user_profile.id))
+
+    def test_real_transactions(self):
+        self.assert_no_sort(TransactionReal.get_history_sources(self.user_profile.id))
+
+
+class HistorySourcesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.group_account = GroupAccount.objects.create(name='group')
+        cls.user_profiles = []
+        for i in range(3):
+            user = User.objects.create_user('user' + str(i), 'user' + str(i) + '@example.com', 'password')
+            user_profile = UserProfile.objects.get(user=user)
+            user_profile.group_accounts.add(cls.group_account)
+            cls.user_profiles.append(user_profile)
+
+    def test_each_share_once_with_its_amount_per_person(self):
+        me, other, third = self.user_profiles
+        shares = []
+        for i in range(30):
+            buyer = [me, other, third][i % 3]
+            share = Transaction.objects.create(
+                amount=Decimal('3.00'), what='share', buyer=buyer, group_account=self.group_account
+            )
+            share.consumers.set([me, other] if i % 2 else [other, third])
+            shares.append(share)
+
+        paginator = KeysetPaginator(Transaction.get_history_sources(me.id), 4)
+        page = paginator.page()
+        seen = list(page)
+        while page.has_next:
+            page = paginator.page(after=page.next_cursor)
+            seen += list(page)
+
+        expected = [share for share in reversed(shares) if share.buyer_id == me.id or me in share.consumers.all()]
+        self.assertEqual([share.id for share in seen], [share.id for share in expected])
+        for share in seen:
+            bought = Decimal('3.00') if share.buyer_id == me.id else Decimal('0.00')
+            consumed = Decimal('1.50') if me in share.consumers.all() else Decimal('0.00')
+            self.assertAlmostEqual(share.amount_per_person_float, float(bought - consumed))
+
+    def test_consumer_rows_follow_the_share(self):
+        share = Transaction.objects.create(
+            amount=Decimal('3.00'), what='share', buyer=self.user_profiles[0], group_account=self.group_account
+        )
+        share.consumers.set(self.user_profiles)
+        share.last_modified = datetime.datetime(2030, 1, 1)
+        share.save()
+        self.assertEqual(
+            set(TransactionConsumer.objects.filter(transaction=share).values_list('last_modified', flat=True)),
+            {datetime.datetime(2030, 1, 1)}
+        )
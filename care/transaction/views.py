@@ -1,10 +1,10 @@
 import logging
 
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.http import HttpResponseRedirect
 from django.views.generic.edit import FormView
 
-from care.base.views import BaseView
+from care.base.pagination import KeysetPaginator
+from care.base.views import BaseView, ConditionalView
 from care.transaction.models import Transaction
 from care.transaction.models import TransactionRecurring
 from care.transaction.models import TransactionReal
@@ -18,7 +18,7 @@ from care.userprofile.models import UserProfile
 logger = logging.getLogger(__name__)
 
 
-class MyTransactionView(BaseView):
+class MyTransactionView(ConditionalView):
     template_name = "transaction/share/mytransactions.html"
     context_object_name = "my transactions"
 
@@ -26,20 +26,11 @@ class MyTransactionView(BaseView):
         return 'shares'
 
     def get_context_data(self, **kwargs):
-        userprofile = UserProfile.objects.get(user=self.request.user)
+        userprofile = self.request.userprofile
         userprofile.get_show_table(self.kwargs['tableView'])
         context = super().get_context_data(**kwargs)
-        transactions_all_sorted = Transaction.get_transactions_sorted_by_last_modified(userprofile.id)
-        paginator = Paginator(transactions_all_sorted, 25)
-
-        page = self.request.GET.get('page')
-        try:
-            transactions_all_sorted = paginator.page(page)
-        except PageNotAnInteger:
-            transactions_all_sorted = paginator.page(1)
-        except EmptyPage:
-            transactions_all_sorted = paginator.page(paginator.num_pages)
-        context['transactions_all'] = transactions_all_sorted
+        paginator = KeysetPaginator(Transaction.get_history_sources(userprofile.id), 25)
+        context['transactions_all'] = paginator.page(self.request.GET.get('after'), self.request.GET.get('before'))
         return context
 
 
@@ -49,7 +40,7 @@ class SelectGroupTransactionView(BaseView):
 
     def get_context_data(self, **kwargs):
         context = super(SelectGroupTransactionView, self).get_context_data(**kwargs)
-        user_profile = UserProfile.objects.get(user=self.request.user)
+        user_profile = self.request.userprofile
         groupaccounts = user_profile.group_accounts.all
         context['groupaccounts'] = groupaccounts
         return context
@@ -68,14 +59,14 @@ class NewTransactionView(FormView, BaseView):
             return self.kwargs['group_account_id']
         else:
             logger.debug(self.request.user.id)
-            user = UserProfile.objects.get(user=self.request.user)
+            user = self.request.userprofile
             if user.group_accounts.count():
                 return user.group_accounts.all()[0].id
             else:
                 return 0
 
     def get_form(self, form_class=NewTransactionForm):
-        return NewTransactionForm(self.get_groupaccount_id(), self.request.user, **self.get_form_kwargs())
+        return NewTransactionForm(self.get_groupaccount_id(), self.request.userprofile, **self.get_form_kwargs())
 
     def form_valid(self, form):
         super().form_valid(form)
@@ -83,7 +74,7 @@ class NewTransactionView(FormView, BaseView):
             form.cleaned_data['consumers'] = UserProfile.objects.filter(group_accounts=form.cleaned_data['group_account'])
         form.save()
         transaction = Transaction.objects.get(pk=form.instance.id)
-        Modification.objects.create(user=UserProfile.objects.get(user=self.request.user), transaction=transaction)
+        Modification.objects.create(user=self.request.userprofile, transaction=transaction)
         return HttpResponseRedirect('/transactions/share/0')
 
     def form_invalid(self, form):
@@ -121,13 +112,13 @@ class EditTransactionView(FormView, BaseView):
             form.cleaned_data['consumers'] = UserProfile.objects.filter(group_accounts=form.cleaned_data['group_account'])
         form.save()
         transaction = Transaction.objects.get(pk=self.kwargs['pk'])
-        modif = Modification.objects.create(user=UserProfile.objects.get(user=self.request.user), transaction=transaction)
+        modif = Modification.objects.create(user=self.request.userprofile, transaction=transaction)
         transaction.last_modified = modif.date
         transaction.save()
         return HttpResponseRedirect('/transactions/share/0')
 
 
-class MyRecurringTransactionView(BaseView):
+class MyRecurringTransactionView(ConditionalView):
     template_name = "transaction/recurring/mytransactions.html"
     context_object_name = "my recurring transactions"
 
@@ -135,21 +126,11 @@ class MyRecurringTransactionView(BaseView):
         return 'recurring'
 
     def get_context_data(self, **kwargs):
-        userprofile = UserProfile.objects.get(user=self.request.user)
+        userprofile = self.request.userprofile
         userprofile.get_show_table(self.kwargs['tableView'])
         context = super().get_context_data(**kwargs)
-        transactions_all_sorted = \
-            TransactionRecurring.get_transactions_sorted_by_last_modified(userprofile.id)
-        paginator = Paginator(transactions_all_sorted, 25)
-
-        page = self.request.GET.get('page')
-        try:
-            transactions_all_sorted = paginator.page(page)
-        except PageNotAnInteger:
-            transactions_all_sorted = paginator.page(1)
-        except EmptyPage:
-            transactions_all_sorted = paginator.page(paginator.num_pages)
-        context['transactions_all'] = transactions_all_sorted
+        paginator = KeysetPaginator(TransactionRecurring.get_history_sources(userprofile.id), 25)
+        context['transactions_all'] = paginator.page(self.request.GET.get('after'), self.request.GET.get('before'))
         return context
 
 
@@ -160,7 +141,7 @@ class SelectGroupRecurringTransactionView(BaseView):
     def get_context_data(self, **kwargs):
         context = super(SelectGroupRecurringTransactionView, self) \
             .get_context_data(**kwargs)
-        user_profile = UserProfile.objects.get(user=self.request.user)
+        user_profile = self.request.userprofile
         groupaccounts = user_profile.group_accounts.all
         context['groupaccounts'] = groupaccounts
         return context
@@ -179,7 +160,7 @@ class NewRecurringTransactionView(FormView, BaseView):
             return self.kwargs['group_account_id']
         else:
             logger.debug(self.request.user.id)
-            user = UserProfile.objects.get(user=self.request.user)
+            user = self.request.userprofile
             if user.group_accounts.count():
                 return user.group_accounts.all()[0].id
             else:
@@ -187,7 +168,7 @@ class NewRecurringTransactionView(FormView, BaseView):
 
     def get_form(self, form_class=NewRecurringTransactionForm):
         return NewRecurringTransactionForm(self.get_groupaccount_id(),
-                                           self.request.user,
+                                           self.request.userprofile,
                                            **self.get_form_kwargs())
 
     def form_valid(self, form):
@@ -198,7 +179,7 @@ class NewRecurringTransactionView(FormView, BaseView):
         form.save()
         transaction = TransactionRecurring.objects.get(pk=form.instance.id)
         Modification.objects.create(
-            user=UserProfile.objects.get(user=self.request.user),
+            user=self.request.userprofile,
             transaction_recurring=transaction)
         return HttpResponseRedirect('/transactions/recurring/0')
 
@@ -241,14 +222,14 @@ class EditRecurringTransactionView(FormView, BaseView):
         form.save()
         transaction = TransactionRecurring.objects.get(pk=self.kwargs['pk'])
         modif = Modification.objects.create(
-            user=UserProfile.objects.get(user=self.request.user),
+            user=self.request.userprofile,
             transaction_recurring=transaction)
         transaction.last_modified = modif.date
         transaction.save()
         return HttpResponseRedirect('/transactions/recurring/0')
 
 
-class MyRealTransactionView(BaseView):
+class MyRealTransactionView(ConditionalView):
     template_name = "transaction/real/mytransactionsreal.html"
     context_object_name = "my real transactions"
 
@@ -256,11 +237,11 @@ class MyRealTransactionView(BaseView):
         return 'transactions'
 
     def get_context_data(self, **kwargs):
-        user_profile = UserProfile.objects.get(user=self.request.user)
+        user_profile = self.request.userprofile
         user_profile.get_show_table(self.kwargs['tableView'])
         context = super().get_context_data(**kwargs)
-        transactions_real_all_sorted = TransactionReal.get_transactions_real_sorted_by_last_modified(user_profile.id)
-        context['transactionsreal_all'] = transactions_real_all_sorted
+        paginator = KeysetPaginator(TransactionReal.get_history_sources(user_profile.id), 25)
+        context['transactionsreal_all'] = paginator.page(self.request.GET.get('after'), self.request.GET.get('before'))
         return context
 
 
@@ -270,7 +251,7 @@ class SelectGroupRealTransactionView(BaseView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_profile = UserProfile.objects.get(user=self.request.user)
+        user_profile = self.request.userprofile
         groupaccounts = user_profile.group_accounts.all
         context['groupaccounts'] = groupaccounts
         return context
@@ -289,20 +270,20 @@ class NewRealTransactionView(FormView, BaseView):
             return self.kwargs['group_account_id']
         else:
             logger.debug(self.request.user.id)
-            user = UserProfile.objects.get(user=self.request.user)
+            user = self.request.userprofile
             if user.group_accounts.count():
                 return user.group_accounts.all()[0].id
             else:
                 return 0
 
     def get_form(self, form_class=NewRealTransactionForm):
-        return NewRealTransactionForm(self.get_groupaccount_id(), self.request.user, **self.get_form_kwargs())
+        return NewRealTransactionForm(self.get_groupaccount_id(), self.request.userprofile, **self.get_form_kwargs())
 
     def form_valid(self, form):
         super().form_valid(form)
         form.save()
         transaction = TransactionReal.objects.get(pk=form.instance.id)
-        Modification.objects.create(user=UserProfile.objects.get(user=self.request.user), transaction_real=transaction)
+        Modification.objects.create(user=self.request.userprofile, transaction_real=transaction)
         return HttpResponseRedirect('/')
 
     def form_invalid(self, form):
@@ -342,7 +323,7 @@ class EditRealTransactionView(FormView, BaseView):
         # prevent users that are not part of the transaction to edit the transaction
         if self.request.user == transactionreal.sender.user or self.request.user == transactionreal.receiver.user:
             form.save()
-            modif = Modification.objects.create(user=UserProfile.objects.get(user=self.request.user), transaction_real=transactionreal)
+            modif = Modification.objects.create(user=self.request.userprofile, transaction_real=transactionreal)
             transactionreal.last_modified = modif.date
             transactionreal.save()
         return HttpResponseRedirect('/transactions/real/0')
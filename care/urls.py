@@ -5,7 +5,7 @@ from django.views.i18n import JavaScriptCatalog
 
 from registration.forms import RegistrationFormUniqueEmail
 
-from care.base.views import HomeView, AboutView, HelpView, NewRegistrationView
+from care.base.views import HomeView, ActivityView, AboutView, HelpView, NewRegistrationView
 import care.userprofile.views
 
 
@@ -31,6 +31,7 @@ js_info_dict = {
 
 urlpatterns = [
     path("", login_required(HomeView.as_view())),
+    path("activity/", login_required(ActivityView.as_view())),
     path("help/", HelpView.as_view()),
     path("about/", AboutView.as_view()),
     path("transactions/", include("care.transaction.urls")),
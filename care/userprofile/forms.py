@@ -5,13 +5,12 @@ from care.userprofile.models import UserProfile, NotificationInterval
 
 
 class EditUserProfileForm(forms.ModelForm):
-    def __init__(self, user, *args, **kwargs):
+    def __init__(self, user_profile, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        user_profile = UserProfile.objects.get(user=user)
 
         self.fields['user'] = forms.ModelChoiceField(
             widget=forms.HiddenInput,
-            queryset=User.objects.filter(id=user.id),
+            queryset=User.objects.filter(id=user_profile.user_id),
             empty_label=None
         )
 
@@ -0,0 +1,24 @@
+from django.utils.functional import SimpleLazyObject
+
+from care.userprofile.models import UserProfile
+
+
+def get_userprofile(request):
+    """ The profile of the logged in user, loaded together with its user the first time it is needed """
+    if not hasattr(request, '_cached_userprofile'):
+        if request.user.is_authenticated:
+            request._cached_userprofile = UserProfile.objects.select_related('user').get(user_id=request.user.id)
+        else:
+            request._cached_userprofile = None
+    return request._cached_userprofile
+
+
+class UserProfileMiddleware(object):
+    """ Adds request.userprofile, so views and forms share a single profile lookup per request """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.userprofile = SimpleLazyObject(lambda: get_userprofile(request))
+        return self.get_response(request)
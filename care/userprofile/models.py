@@ -1,16 +1,20 @@
+from collections import defaultdict
 from datetime import date, timedelta
+from decimal import Decimal
 import logging
 
 
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import Sum, Count, F, ExpressionWrapper
-from django.db.models.signals import post_save
+from django.db import models, transaction as db_transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
 
 from registration.signals import user_registered
 
+from care.groupaccount import groupcache
 from care.groupaccount.models import GroupAccount
 import care.base.emailserver as emailserver
 
@@ -52,30 +56,120 @@ class UserProfile(models.Model):
     def __str__(self):
         return str(self.displayname)
 
+    def requested_show_table(self, do_show_table):
+        """ Whether a page is shown as a table: 1 in the url asks for the list, 2 for the table and
+        anything else for the stored preference """
+        return {1: False, 2: True}.get(int(do_show_table), self.showTableView)
+
     def get_show_table(self, do_show_table):
-        if int(do_show_table) == 1 and self.showTableView:
-            self.showTableView = False
-            self.save()
-        if int(do_show_table) == 2 and not self.showTableView:
-            self.showTableView = True
-            self.save()
+        show_table = self.requested_show_table(do_show_table)
+        if show_table != self.showTableView:
+            self.showTableView = show_table
+            self.save(update_fields=['showTableView'])
 
     def send_transaction_history(self, force_send=False):
         if self.historyEmailInterval.days == 0 and not force_send:
             return # do not send anything when it is not forced and user set to 0 days
+        UserProfile.send_transaction_histories(UserProfile.objects.filter(id=self.id), self.historyEmailInterval.days)
+
+    @staticmethod
+    def send_transaction_histories(userprofiles, days):
+        """ Queues the history of the last days for every user profile in the queryset that has one.
+        Returns the number of emails. """
+        from care.base.models import OutgoingEmail
+        mails = UserProfile.transaction_history_mails(userprofiles, days)
+        OutgoingEmail.objects.bulk_create(mails.values())
+        return len(mails)
+
+    @staticmethod
+    def transaction_history_mails(userprofiles, days):
+        """ The unsaved history emails of the last days, keyed on user profile id, for the user profiles in
+        the queryset that have a history. The tables of all of them are built by the same few queries. """
         date_end = date.today()
-        date_start = date_end - timedelta(self.historyEmailInterval.days)
+        date_start = date_end - timedelta(days)
         import care.base.mailnotification as mailnotification
-        transaction_table_html = mailnotification.create_transaction_history_table_html(self, date_start, date_end)
-        transaction_real_table = mailnotification.create_transaction_real_history_table_html(self, date_start, date_end)
-
-        if transaction_table_html == '' and transaction_real_table == '':
-            return
-        emailserver.send_transaction_history(self.user.username, self.user.email, transaction_table_html, transaction_real_table, date_start, date_end)
+        tables = mailnotification.create_transaction_history_tables(userprofiles, date_start, date_end)
+        mails = {}
+        for userprofile in userprofiles.select_related('user'):
+            if userprofile.id not in tables:
+                continue
+            transaction_table_html, transaction_real_table = tables[userprofile.id]
+            mails[userprofile.id] = emailserver.transaction_history_mail(userprofile.user.username, userprofile.user.email, transaction_table_html, transaction_real_table, date_start, date_end)
+        return mails
 
     @staticmethod
     def get_balance(group_account_id, user_profile_id):
+        from care.transaction.models import GroupBalance
+        return GroupBalance.get_balance(group_account_id, user_profile_id)
+
+    @staticmethod
+    def get_balances(group_account_ids):
+        """ Ledger balances of all members of the given group accounts in one query,
+        keyed on (group_account_id, user_profile_id) """
+        from care.transaction.models import GroupBalance
+        rows = GroupBalance.objects.filter(
+            group_account_id__in=group_account_ids
+        ).values_list('group_account_id', 'user_profile_id', 'balance')
+        return {(group_account_id, user_profile_id): balance for group_account_id, user_profile_id, balance in rows}
+
+    @staticmethod
+    def get_low_balance_memberships(interval):
+        """ Group account memberships with a balance below the lower limit of the group, for the groups that
+        send balance reminders every interval, in one query. The ledger balance is annotated as balance. """
+        from care.transaction.models import GroupBalance
+        balances = GroupBalance.objects.filter(
+            group_account_id=OuterRef('groupaccount_id'),
+            user_profile_id=OuterRef('userprofile_id')
+        ).values('balance')
+        return (
+            UserProfile.group_accounts.through.objects
+            .filter(groupaccount__settings__notification_lower_limit_interval=interval)
+            .annotate(balance=Coalesce(Subquery(balances), Value(Decimal('0.00')), output_field=DecimalField()))
+            .filter(balance__lt=F('groupaccount__settings__notification_lower_limit'))
+            .select_related('userprofile__user', 'groupaccount__settings')
+        )
+
+    @staticmethod
+    def compute_balances(group_account_ids):
+        """ Same as compute_balance, for everyone in the given group accounts, with four grouped queries.
+        The balances are exact Decimals, like the ledger. """
+        from care.transaction.models import Transaction
+        from care.transaction.models import TransactionConsumer
+        from care.transaction.models import TransactionReal
+
+        balances = defaultdict(Decimal)
+
+        bought = Transaction.objects.filter(
+            group_account_id__in=group_account_ids
+        ).values_list('group_account_id', 'buyer_id').annotate(Sum('amount')).order_by()
+        for group_account_id, user_profile_id, amount__sum in bought:
+            balances[(group_account_id, user_profile_id)] += amount__sum
+
+        sent = TransactionReal.objects.filter(
+            group_account_id__in=group_account_ids
+        ).values_list('group_account_id', 'sender_id').annotate(Sum('amount')).order_by()
+        for group_account_id, user_profile_id, amount__sum in sent:
+            balances[(group_account_id, user_profile_id)] += amount__sum
+
+        received = TransactionReal.objects.filter(
+            group_account_id__in=group_account_ids
+        ).values_list('group_account_id', 'receiver_id').annotate(Sum('amount')).order_by()
+        for group_account_id, user_profile_id, amount__sum in received:
+            balances[(group_account_id, user_profile_id)] -= amount__sum
+
+        consumed = TransactionConsumer.objects.filter(
+            transaction__group_account_id__in=group_account_ids
+        ).values_list('transaction__group_account_id', 'userprofile_id').annotate(Sum('amount')).order_by()
+        for group_account_id, user_profile_id, amount__sum in consumed:
+            balances[(group_account_id, user_profile_id)] -= amount__sum
+
+        return balances
+
+    @staticmethod
+    def compute_balance(group_account_id, user_profile_id):
+        """ Computes the balance from all shares and real transactions, bypassing the GroupBalance ledger """
         from care.transaction.models import Transaction
+        from care.transaction.models import TransactionConsumer
         from care.transaction.models import TransactionReal
 
         buyer_transactions = Transaction.objects.filter(
@@ -83,12 +177,10 @@ class UserProfile(models.Model):
             buyer__id=user_profile_id
         )
 
-        consumer_transactions = Transaction.objects.annotate(
-            amount_per_person=ExpressionWrapper(F('amount') / (1.0 * Count('consumers')), output_field=models.FloatField())
-        ).filter(
-            group_account__id=group_account_id,
-            consumers__id=user_profile_id
-        ).prefetch_related('consumers')
+        consumer_shares = TransactionConsumer.objects.filter(
+            transaction__group_account_id=group_account_id,
+            userprofile_id=user_profile_id
+        )
 
         sender_real_transactions = TransactionReal.objects.filter(
             group_account__id=group_account_id,
@@ -117,9 +209,35 @@ class UserProfile(models.Model):
         if amount__sum:
             total_received = float(amount__sum)
 
-        amount_per_person__sum = consumer_transactions.aggregate(Sum('amount_per_person'))['amount_per_person__sum']
-        if amount_per_person__sum:
-            total_consumed = float(amount_per_person__sum)
+        amount__sum = consumer_shares.aggregate(Sum('amount'))['amount__sum']
+        if amount__sum:
+            total_consumed = float(amount__sum)
 
         balance = (total_bought + total_sent - total_consumed - total_received)
         return balance
+
+
+def _bump_group_versions(group_account_ids):
+    group_account_ids = list(group_account_ids)
+    db_transaction.on_commit(lambda: groupcache.bump_versions(group_account_ids))
+
+
+def groupcache_userprofile_saved(sender, instance, created, update_fields, **kwargs):
+    """ Cached group members hold the display name """
+    if not created and (update_fields is None or 'displayname' in update_fields):
+        _bump_group_versions(instance.group_accounts.values_list('id', flat=True))
+
+
+def groupcache_memberships_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action.startswith('post_'):
+            _bump_group_versions([instance.id])
+    elif action == 'pre_clear':
+        instance._groupcache_group_account_ids = list(instance.group_accounts.values_list('id', flat=True))
+    elif action.startswith('post_'):
+        _bump_group_versions(pk_set if pk_set is not None else getattr(instance, '_groupcache_group_account_ids', []))
+
+
+# cached group members and balances become stale
+post_save.connect(groupcache_userprofile_saved, sender=UserProfile)
+m2m_changed.connect(groupcache_memberships_changed, sender=UserProfile.group_accounts.through)
@@ -0,0 +1,36 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import RequestFactory, TestCase
+
+from care.userprofile.middleware import UserProfileMiddleware, get_userprofile
+from care.userprofile.models import NotificationInterval, UserProfile
+
+
+class UserProfileMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        NotificationInterval.objects.create(name='Monthly', days=30)
+        cls.user = User.objects.create_user('user', 'user@example.com', 'password')
+        cls.userprofile = UserProfile.objects.get(user=cls.user)
+
+    def get_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        UserProfileMiddleware(lambda request: None)(request)
+        return request
+
+    def test_one_query_per_request(self):
+        request = self.get_request(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.userprofile.id, self.userprofile.id)
+            self.assertEqual(request.userprofile.user.username, 'user')
+            self.assertEqual(get_userprofile(request).user.email, 'user@example.com')
+
+    def test_no_query_when_not_used(self):
+        with self.assertNumQueries(0):
+            self.get_request(self.user)
+
+    def test_anonymous(self):
+        request = self.get_request(AnonymousUser())
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_userprofile(request))
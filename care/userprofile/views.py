@@ -19,7 +19,7 @@ class EditUserProfileView(BaseView, FormView):
     success_url = '/'
 
     def get_form(self, form_class=EditUserProfileForm):
-        return EditUserProfileForm(self.request.user, instance=UserProfile.objects.get(user=self.request.user), **self.get_form_kwargs())
+        return EditUserProfileForm(self.request.userprofile, instance=self.request.userprofile, **self.get_form_kwargs())
 
     def form_valid(self, form):
         super().form_valid(form)
@@ -58,7 +58,7 @@ class SendMyTransactionHistory(BaseView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        userprofile = UserProfile.objects.get(user=self.request.user)
+        userprofile = self.request.userprofile
         force_send = True
         userprofile.send_transaction_history(force_send)
         return context
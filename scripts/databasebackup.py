@@ -1,9 +1,13 @@
 #! /usr/bin/python
 
-import shutil
+import logging
+import os
+import sys
 
-from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-now = datetime.now()
-nowStr = now.strftime('%Y%m%d')
-shutil.copy('../care.sqlite', '../backup/' + nowStr + 'care.sqlite')
+from care.base.backup import backup_database, rotate_backups
+
+logging.basicConfig(level=logging.INFO)
+backup_database('../care.sqlite', '../backup/')
+rotate_backups('../backup/')